@@ -1,7 +1,9 @@
-from flask import Flask, request, jsonify, send_file, render_template, redirect, url_for, session
+from flask import Flask, Response, request, jsonify, send_file, render_template, redirect, url_for, session, stream_with_context
 from datetime import datetime, timedelta
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+from concurrent.futures import ProcessPoolExecutor
 from werkzeug.security import generate_password_hash, check_password_hash
-import sqlite3, csv, io, os, json
+import sqlite3, csv, io, os, sys, json, gzip, re, threading, hashlib, time, multiprocessing
 
 # Flask lädt Templates (index.html, admin.html, login.html) aus dem aktuellen Ordner
 app = Flask(__name__, template_folder='.')
@@ -9,6 +11,22 @@ app.secret_key = os.environ.get("POS_SECRET", "please_change_me")
 
 CURRENCY = "CHF"
 DB_PATH = os.environ.get("POS_DB", "sales.db")
+AUDIT_FTS = False  # wird in init_db() gesetzt, falls SQLite FTS5 unterstützt
+# Audit-Einträge älter als N Tage werden in monatliche .ndjson.gz-Archive verschoben (0 = nie)
+AUDIT_RETENTION_DAYS = int(os.environ.get("POS_AUDIT_RETENTION_DAYS", "0"))
+ARCHIVE_DIR = os.environ.get("POS_ARCHIVE_DIR") or os.path.join(os.path.dirname(os.path.abspath(DB_PATH)), "archive")
+# Unveränderliche Tagesabschlüsse (CSV/PDF)
+REPORTS_DIR = os.environ.get("POS_REPORTS_DIR") or os.path.join(os.path.dirname(os.path.abspath(DB_PATH)), "reports")
+# Live-Streams (SSE) pro Prozess; jeder belegt einen Worker-Thread. 0 = nur Polling (z.B. gthread mit 1 Thread)
+STREAM_SLOTS = int(os.environ.get("POS_STREAM_SLOTS", "0"))
+# Leerlauf-Jobs (Auswertungen vorberechnen, Backup, VACUUM) nach N s ohne /sale; läuft in einem per Lease gewählten Worker
+SCHEDULER = os.environ.get("POS_SCHEDULER", "1") == "1"
+IDLE_SECONDS = int(os.environ.get("POS_IDLE_SECONDS", "60"))
+BACKUP_DIR = os.environ.get("POS_BACKUP_DIR") or os.path.join(os.path.dirname(os.path.abspath(DB_PATH)), "backups")
+BACKUP_HOURS = float(os.environ.get("POS_BACKUP_HOURS", "24"))  # 0 = keine Backups
+BACKUP_KEEP = int(os.environ.get("POS_BACKUP_KEEP", "7"))
+# Geteiltes Timer-Board in eigener kleiner DB, damit Timer-Klicks nie um die Schreibsperre von /sale konkurrieren
+TIMER_DB_PATH = os.environ.get("POS_TIMER_DB") or os.path.splitext(os.path.abspath(DB_PATH))[0] + "_timers.db"
 
 # ---------- DB ----------
 
@@ -18,24 +36,148 @@ def conn():
     return c
 
 
+def timer_conn():
+    c = sqlite3.connect(TIMER_DB_PATH)
+    c.row_factory = sqlite3.Row
+    c.execute("PRAGMA synchronous=NORMAL")  # WAL: flüchtiger Zustand, kein fsync pro Klick nötig
+    return c
+
+
+def init_timer_db(c):
+    """Legt die Timer-DB an und übernimmt ein bisher in meta gespeichertes Board."""
+    t = timer_conn()
+    t.execute("PRAGMA journal_mode=WAL")
+    t.execute("CREATE TABLE IF NOT EXISTS board(id INTEGER PRIMARY KEY CHECK (id = 1), value TEXT NOT NULL)")
+    old = c.execute("SELECT value FROM meta WHERE key='timer_board'").fetchone()
+    if old:
+        t.execute("INSERT OR IGNORE INTO board(id, value) VALUES(1, ?)", (old["value"],))
+        c.execute("DELETE FROM meta WHERE key='timer_board'")
+    t.commit(); t.close()
+
+
+def to_cents(value):
+    """CHF-Betrag (Zahl oder Text, auch mit Komma) -> ganze Rappen, kaufmännisch gerundet"""
+    try:
+        return int(Decimal(str(value or 0).strip().replace(",", ".")).quantize(Decimal("0.01"), ROUND_HALF_UP) * 100)
+    except InvalidOperation:
+        raise ValueError(f"Ungültiger Betrag: {value!r}")
+
+
+def from_cents(cents):
+    """Rappen -> CHF (nur für API/Export)"""
+    return None if cents is None else cents / 100
+
+
+def rebuild_rollups(c):
+    """Baut die stündlichen Rollups und Schicht-Summen komplett aus sale_headers/sale_lines neu auf."""
+    c.execute("DELETE FROM rollup_hourly")
+    c.execute("DELETE FROM rollup_hourly_items")
+    c.execute("DELETE FROM shift_totals")
+    c.execute(
+        "INSERT INTO rollup_hourly(hour, payment_method_id, sales, revenue_cents) "
+        "SELECT substr(ts,1,13), payment_method_id, COUNT(*), SUM(total_cents) FROM sale_headers GROUP BY 1, 2"
+    )
+    c.execute(
+        "INSERT INTO rollup_hourly_items(hour, item_id, qty, revenue_cents) "
+        "SELECT substr(h.ts,1,13), l.item_id, SUM(l.qty), SUM(l.total_cents) "
+        "FROM sale_lines l JOIN sale_headers h ON h.id=l.sale_id GROUP BY 1, 2"
+    )
+    c.execute(
+        "INSERT INTO shift_totals(shift_id, payment_method_id, sales, revenue_cents) "
+        "SELECT shift_id, payment_method_id, COUNT(*), SUM(total_cents) FROM sale_headers "
+        "WHERE shift_id IS NOT NULL GROUP BY 1, 2"
+    )
+
+
+def migrate_money_to_cents(c):
+    """
+    Einmalige Migration: Geldspalten REAL (CHF) -> INTEGER (Rappen, Spaltenname *_cents).
+    Abgeleitete Tabellen (Rollups, Schicht-Summen) werden verworfen und danach neu aufgebaut.
+    """
+    def columns(table):
+        return {r[1] for r in c.execute(f"PRAGMA table_info({table})").fetchall()}
+
+    for table in ("rollup_hourly", "rollup_hourly_items", "shift_totals"):
+        if "revenue" in columns(table):
+            c.execute(f"DROP TABLE {table}")
+    plan = {
+        "items": ("price",),
+        "sales": ("price", "total"),
+        "sale_headers": ("total",),
+        "sale_lines": ("price", "total"),
+        "shifts": ("opening_cash", "counted_cash"),
+    }
+    for table, cols in plan.items():
+        existing = columns(table)
+        for col in cols:
+            if col not in existing:
+                continue
+            nullable = col == "counted_cash"
+            c.execute(f"ALTER TABLE {table} ADD COLUMN {col}_cents INTEGER" + ("" if nullable else " NOT NULL DEFAULT 0"))
+            c.execute(f"UPDATE {table} SET {col}_cents = CAST(ROUND({col} * 100) AS INTEGER)")
+            c.execute(f"ALTER TABLE {table} DROP COLUMN {col}")
+    c.commit()
+
+
+def is_table(c, name):
+    return bool(c.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (name,)).fetchone())
+
+
+def normalize_sale_lines(c):
+    """
+    Einmalige Migration: sale_lines (Name/Preis/Total je Zeile) und die doppelte Tabelle sales
+    -> item_versions + sale_items (Version + Menge). Danach sind sale_lines und sales Views
+    mit den bisherigen Spalten. sales-Zeilen ohne Verkaufskopf wandern nach sales_legacy.
+    """
+    if not is_table(c, "sale_lines"):
+        return
+    c.execute(
+        """
+        INSERT INTO item_versions(item_id, name, price_cents, valid_from)
+        SELECT l.item_id, l.item_name, l.price_cents, COALESCE(MIN(h.ts), datetime('now', 'localtime'))
+        FROM sale_lines l LEFT JOIN sale_headers h ON h.id = l.sale_id
+        GROUP BY l.item_id, l.item_name, l.price_cents
+        ORDER BY 4
+        """
+    )
+    c.execute(
+        """
+        INSERT INTO sale_items(id, sale_id, version_id, qty)
+        SELECT l.id, l.sale_id,
+               (SELECT MIN(v.id) FROM item_versions v
+                WHERE v.item_id IS l.item_id AND v.name = l.item_name AND v.price_cents = l.price_cents),
+               l.qty
+        FROM sale_lines l
+        """
+    )
+    if is_table(c, "sales"):
+        c.execute(
+            """
+            INSERT INTO sales_legacy(id, ts, item_id, item_name, qty, price_cents, total_cents)
+            SELECT s.id, s.ts, s.item_id, s.item_name, s.qty, s.price_cents, s.total_cents FROM sales s
+            WHERE s.sale_id IS NULL AND NOT EXISTS (SELECT 1 FROM sale_headers h WHERE h.ts = s.ts)
+            """
+        )
+        c.execute("DROP TABLE sales")
+    c.execute("DROP TABLE sale_lines")
+    # Die frei gewordenen Seiten bleiben in der Freelist und werden von neuen Daten wiederverwendet;
+    # die Datei schrumpft erst nach der Umstellung über POST /api/admin/vacuum
+    c.commit()
+
+
 def init_db():
     c = conn()
+    # Neue DBs gleich mit incremental auto_vacuum anlegen (wirkt nur vor der ersten Tabelle);
+    # bestehende DBs stellt ein Admin einmalig über POST /api/admin/vacuum um
+    c.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    migrate_money_to_cents(c)
     c.executescript(
         """
-        CREATE TABLE IF NOT EXISTS sales(
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            ts TEXT NOT NULL,
-            item_id INTEGER NOT NULL,
-            item_name TEXT NOT NULL,
-            qty INTEGER NOT NULL,
-            price REAL NOT NULL,
-            total REAL NOT NULL
-        );
-
+        -- Geldbeträge durchgehend als INTEGER in Rappen (*_cents), Umrechnung nur an API/Export
         CREATE TABLE IF NOT EXISTS items(
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             name TEXT NOT NULL,
-            price REAL NOT NULL,
+            price_cents INTEGER NOT NULL DEFAULT 0,
             active INTEGER NOT NULL DEFAULT 1,
             sort INTEGER NOT NULL DEFAULT 0
         );
@@ -61,19 +203,62 @@ def init_db():
             ts TEXT NOT NULL,
             user_id INTEGER NOT NULL,
             payment_method_id INTEGER NOT NULL,
-            total REAL NOT NULL,
+            total_cents INTEGER NOT NULL DEFAULT 0,
             FOREIGN KEY(user_id) REFERENCES users(id),
             FOREIGN KEY(payment_method_id) REFERENCES payment_methods(id)
         );
-        CREATE TABLE IF NOT EXISTS sale_lines(
+
+        -- Vorberechnete Auswertungen (Leerlauf-Jobs); gültig solange fingerprint zum Verkaufsstand passt
+        CREATE TABLE IF NOT EXISTS report_cache(
+            key TEXT PRIMARY KEY,
+            day TEXT,
+            fingerprint TEXT NOT NULL,
+            data BLOB NOT NULL,
+            created_at TEXT NOT NULL
+        );
+        -- Leases (z.B. welcher Worker die Leerlauf-Jobs ausführt) und Laufzeiten der Jobs
+        CREATE TABLE IF NOT EXISTS leases(
+            name TEXT PRIMARY KEY,
+            owner TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS job_runs(
+            name TEXT PRIMARY KEY,
+            last_run REAL,
+            last_ok REAL,
+            duration_ms INTEGER,
+            status TEXT,
+            msg TEXT,
+            runs INTEGER NOT NULL DEFAULT 0,
+            worker TEXT
+        );
+
+        -- Artikelversionen: Name/Preis eines Artikels ab valid_from (per Trigger bei Änderung angelegt)
+        CREATE TABLE IF NOT EXISTS item_versions(
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            item_id INTEGER,
+            name TEXT NOT NULL,
+            price_cents INTEGER NOT NULL,
+            valid_from TEXT NOT NULL
+        );
+        -- Positionen: nur Version + Menge; Name, Preis und Total liefert die View sale_lines
+        CREATE TABLE IF NOT EXISTS sale_items(
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             sale_id INTEGER NOT NULL,
-            item_id INTEGER NOT NULL,
+            version_id INTEGER NOT NULL,
+            qty INTEGER NOT NULL,
+            FOREIGN KEY(sale_id) REFERENCES sale_headers(id),
+            FOREIGN KEY(version_id) REFERENCES item_versions(id)
+        );
+        -- Alte Einzelverkäufe ohne zugehörigen Verkaufskopf (aus der früheren Tabelle sales)
+        CREATE TABLE IF NOT EXISTS sales_legacy(
+            id INTEGER PRIMARY KEY,
+            ts TEXT NOT NULL,
+            item_id INTEGER,
             item_name TEXT NOT NULL,
             qty INTEGER NOT NULL,
-            price REAL NOT NULL,
-            total REAL NOT NULL,
-            FOREIGN KEY(sale_id) REFERENCES sale_headers(id)
+            price_cents INTEGER NOT NULL DEFAULT 0,
+            total_cents INTEGER NOT NULL DEFAULT 0
         );
 
         CREATE TABLE IF NOT EXISTS audit_log(
@@ -98,6 +283,75 @@ def init_db():
             sound_type TEXT NOT NULL DEFAULT 'beep',
             FOREIGN KEY(user_id) REFERENCES users(id)
         );
+
+        -- Stündliche Rollups (inkrementell bei Verkauf/Storno gepflegt), hour = 'YYYY-MM-DD HH'
+        CREATE TABLE IF NOT EXISTS rollup_hourly(
+            hour TEXT NOT NULL,
+            payment_method_id INTEGER NOT NULL,
+            sales INTEGER NOT NULL DEFAULT 0,
+            revenue_cents INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY(hour, payment_method_id)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS rollup_hourly_items(
+            hour TEXT NOT NULL,
+            item_id INTEGER NOT NULL,
+            qty INTEGER NOT NULL DEFAULT 0,
+            revenue_cents INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY(hour, item_id)
+        ) WITHOUT ROWID;
+
+        -- Schichten (Kassenabrechnung pro Benutzer), Summen je Zahlart inkrementell gepflegt
+        CREATE TABLE IF NOT EXISTS shifts(
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            opened_at TEXT NOT NULL,
+            closed_at TEXT,
+            opening_cash_cents INTEGER NOT NULL DEFAULT 0,
+            counted_cash_cents INTEGER,
+            note TEXT,
+            FOREIGN KEY(user_id) REFERENCES users(id)
+        );
+        CREATE TABLE IF NOT EXISTS shift_totals(
+            shift_id INTEGER NOT NULL,
+            payment_method_id INTEGER NOT NULL,
+            sales INTEGER NOT NULL DEFAULT 0,
+            revenue_cents INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY(shift_id, payment_method_id)
+        ) WITHOUT ROWID;
+
+        -- Tagesabschlüsse (Z-Berichte): eingefrorene Aggregate + Hashes der Dateien in REPORTS_DIR
+        CREATE TABLE IF NOT EXISTS day_closes(
+            day TEXT PRIMARY KEY,
+            closed_at TEXT NOT NULL,
+            closed_by INTEGER,
+            data TEXT NOT NULL,
+            data_sha256 TEXT NOT NULL,
+            csv_sha256 TEXT,
+            pdf_sha256 TEXT,
+            changed_at TEXT
+        );
+
+        -- Rezepte: Artikel, die Lagerbestand anderer Artikel verbrauchen (z.B. Kombi = Hot Dog + Getränk)
+        CREATE TABLE IF NOT EXISTS item_components(
+            item_id INTEGER NOT NULL,
+            component_id INTEGER NOT NULL,
+            qty INTEGER NOT NULL DEFAULT 1,
+            PRIMARY KEY(item_id, component_id)
+        ) WITHOUT ROWID;
+
+        -- Lagerwarnungen (offen bis der Bestand wieder über der Schwelle liegt)
+        CREATE TABLE IF NOT EXISTS stock_alerts(
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            item_id INTEGER NOT NULL,
+            ts TEXT NOT NULL,
+            stock INTEGER NOT NULL,
+            resolved_at TEXT
+        );
+
+        CREATE TABLE IF NOT EXISTS meta(
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        );
         """
     )
 
@@ -109,21 +363,147 @@ def init_db():
     c.execute("CREATE UNIQUE INDEX IF NOT EXISTS uq_items_name ON items(name)")
     c.execute("CREATE UNIQUE INDEX IF NOT EXISTS uq_pm_name ON payment_methods(name)")
 
+    # Migration: Schicht-Zuordnung der Verkäufe
+    try:
+        c.execute("ALTER TABLE sale_headers ADD COLUMN shift_id INTEGER")
+    except sqlite3.OperationalError:
+        pass  # Spalte existiert bereits
+    # Migration: Kompatibilitätstabelle sales an den Verkauf koppeln (statt Zuordnung über ts)
+    if is_table(c, "sales"):
+        try:
+            c.execute("ALTER TABLE sales ADD COLUMN sale_id INTEGER")
+            c.execute(
+                "UPDATE sales SET sale_id=(SELECT MIN(h.id) FROM sale_headers h WHERE h.ts=sales.ts) "
+                "WHERE (SELECT COUNT(*) FROM sale_headers h WHERE h.ts=sales.ts)=1"
+            )
+        except sqlite3.OperationalError:
+            pass  # Spalte existiert bereits
+
+    # Migration: Positionen auf Artikelversionen umstellen; sale_lines/sales werden Views
+    normalize_sale_lines(c)
+    c.executescript(
+        """
+        CREATE VIEW IF NOT EXISTS sale_lines AS
+            SELECT si.id, si.sale_id, v.item_id, v.name AS item_name, si.qty, v.price_cents,
+                   si.qty * v.price_cents AS total_cents, si.version_id
+            FROM sale_items si JOIN item_versions v ON v.id = si.version_id;
+        CREATE VIEW IF NOT EXISTS sales AS
+            SELECT si.id, h.ts, v.item_id, v.name AS item_name, si.qty, v.price_cents,
+                   si.qty * v.price_cents AS total_cents, si.sale_id
+            FROM sale_items si
+            JOIN sale_headers h ON h.id = si.sale_id
+            JOIN item_versions v ON v.id = si.version_id
+            UNION ALL
+            SELECT id, ts, item_id, item_name, qty, price_cents, total_cents, NULL FROM sales_legacy;
+
+        CREATE TRIGGER IF NOT EXISTS items_version_ai AFTER INSERT ON items BEGIN
+            INSERT INTO item_versions(item_id, name, price_cents, valid_from)
+            VALUES (new.id, new.name, new.price_cents, datetime('now', 'localtime'));
+        END;
+        CREATE TRIGGER IF NOT EXISTS items_version_au AFTER UPDATE OF name, price_cents ON items
+        WHEN old.name IS NOT new.name OR old.price_cents IS NOT new.price_cents BEGIN
+            INSERT INTO item_versions(item_id, name, price_cents, valid_from)
+            VALUES (new.id, new.name, new.price_cents, datetime('now', 'localtime'));
+        END;
+        """
+    )
+    c.execute("CREATE INDEX IF NOT EXISTS idx_item_versions_item ON item_versions(item_id, id)")
+    # Artikel ohne passende aktuelle Version (Bestand vor den Triggern) nachtragen
+    c.execute(
+        """
+        INSERT INTO item_versions(item_id, name, price_cents, valid_from)
+        SELECT i.id, i.name, i.price_cents, datetime('now', 'localtime') FROM items i
+        LEFT JOIN item_versions v ON v.id = (SELECT MAX(id) FROM item_versions WHERE item_id = i.id)
+        WHERE v.id IS NULL OR v.name IS NOT i.name OR v.price_cents IS NOT i.price_cents
+        """
+    )
+
+    # Migration: Lagerbestand pro Artikel (NULL = nicht geführt) und Warnschwelle
+    for ddl in ("ALTER TABLE items ADD COLUMN stock INTEGER",
+                "ALTER TABLE items ADD COLUMN low_stock INTEGER NOT NULL DEFAULT 0"):
+        try:
+            c.execute(ddl)
+        except sqlite3.OperationalError:
+            pass  # Spalte existiert bereits
+    c.execute("CREATE UNIQUE INDEX IF NOT EXISTS uq_stock_alerts_open ON stock_alerts(item_id) WHERE resolved_at IS NULL")
+
+    # Pro Benutzer höchstens eine offene Schicht
+    c.execute("CREATE UNIQUE INDEX IF NOT EXISTS uq_shifts_open ON shifts(user_id) WHERE closed_at IS NULL")
+
+    # Verkäufe: Indizes für Zeitbereiche und Positionen je Verkauf
+    c.execute("CREATE INDEX IF NOT EXISTS idx_sale_headers_ts ON sale_headers(ts)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_sale_items_sale ON sale_items(sale_id)")
+
+    # Rollups einmalig aus bestehenden Verkäufen aufbauen
+    if not c.execute("SELECT 1 FROM rollup_hourly LIMIT 1").fetchone() and \
+            c.execute("SELECT 1 FROM sale_headers LIMIT 1").fetchone():
+        rebuild_rollups(c)
+
+    # Audit-Log: Indizes für Filter nach Aktion/Zeit, Entität und Benutzer
+    c.execute("CREATE INDEX IF NOT EXISTS idx_audit_action_ts ON audit_log(action, ts)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_audit_entity ON audit_log(entity_type, entity_id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_audit_user ON audit_log(user_id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_audit_ts ON audit_log(ts)")
+
+    # Migration: ältere Audit-Details wurden mit \uXXXX-Escapes gespeichert ("Getr\u00e4nk"),
+    # einmalig als Klartext-JSON neu schreiben, damit die Suche Umlaute findet
+    audit_unescaped = False
+    if not c.execute("SELECT 1 FROM meta WHERE key='audit_details_utf8'").fetchone():
+        fixed = []
+        for r in c.execute("SELECT id, details FROM audit_log WHERE instr(details, '\\u') > 0").fetchall():
+            try:
+                fixed.append((json.dumps(json.loads(r["details"]), ensure_ascii=False), r["id"]))
+            except ValueError:
+                pass  # kein JSON (Freitext), unverändert lassen
+        c.executemany("UPDATE audit_log SET details=? WHERE id=?", fixed)
+        c.execute("INSERT INTO meta(key, value) VALUES('audit_details_utf8', '1')")
+        audit_unescaped = bool(fixed)
+
+    # Audit-Log: Volltextsuche (FTS5, external content) über details/username/action
+    global AUDIT_FTS
+    try:
+        fts_new = not c.execute(
+            "SELECT 1 FROM sqlite_master WHERE type='table' AND name='audit_fts'"
+        ).fetchone()
+        c.executescript(
+            """
+            CREATE VIRTUAL TABLE IF NOT EXISTS audit_fts USING fts5(
+                details, username, action, content='audit_log', content_rowid='id'
+            );
+            CREATE TRIGGER IF NOT EXISTS audit_fts_ai AFTER INSERT ON audit_log BEGIN
+                INSERT INTO audit_fts(rowid, details, username, action)
+                VALUES (new.id, new.details, new.username, new.action);
+            END;
+            CREATE TRIGGER IF NOT EXISTS audit_fts_ad AFTER DELETE ON audit_log BEGIN
+                INSERT INTO audit_fts(audit_fts, rowid, details, username, action)
+                VALUES ('delete', old.id, old.details, old.username, old.action);
+            END;
+            """
+        )
+        if fts_new or audit_unescaped:
+            c.execute("INSERT INTO audit_fts(audit_fts) VALUES('rebuild')")
+        AUDIT_FTS = True
+    except sqlite3.OperationalError:
+        AUDIT_FTS = False  # SQLite ohne FTS5 -> Suche fällt auf LIKE zurück
+
     # Migration: sound_type Spalte zu user_timers hinzufügen falls nicht vorhanden
     try:
         c.execute("ALTER TABLE user_timers ADD COLUMN sound_type TEXT NOT NULL DEFAULT 'beep'")
     except:
         pass  # Spalte existiert bereits
 
+    # Katalog-Version (wird bei jeder Änderung an Artikeln/Zahlarten erhöht)
+    c.execute("INSERT OR IGNORE INTO meta(key, value) VALUES('catalog_version', '1')")
+
     # Seed Items (mit OR IGNORE abgesichert)
     if c.execute("SELECT COUNT(*) FROM items").fetchone()[0] == 0:
         c.executemany(
-            "INSERT OR IGNORE INTO items(name,price,active,sort) VALUES(?,?,?,?)",
+            "INSERT OR IGNORE INTO items(name,price_cents,active,sort) VALUES(?,?,?,?)",
             [
-                ("Hot Dog", 6.00, 1, 0),
-                ("Veggie Dog", 6.50, 1, 1),
-                ("Getränk", 3.00, 1, 2),
-                ("Kombi (Dog+Drink)", 8.50, 1, 3),
+                ("Hot Dog", 600, 1, 0),
+                ("Veggie Dog", 650, 1, 1),
+                ("Getränk", 300, 1, 2),
+                ("Kombi (Dog+Drink)", 850, 1, 3),
             ],
         )
 
@@ -145,6 +525,7 @@ def init_db():
             ("Kasse", generate_password_hash("0000"), 0),
         )
 
+    init_timer_db(c)
     c.commit(); c.close()
 
 
@@ -160,12 +541,248 @@ def log_action(cur, action, entity_type=None, entity_id=None, details=None, user
     ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     user_id = user.get("id") if user else None
     username = user.get("username") if user else None
-    details_json = json.dumps(details) if details and isinstance(details, dict) else details
+    # ensure_ascii=False: Umlaute bleiben lesbar und über Volltext/LIKE auffindbar
+    details_json = json.dumps(details, ensure_ascii=False) if details and isinstance(details, dict) else details
     cur.execute(
         "INSERT INTO audit_log(ts, user_id, username, action, entity_type, entity_id, details, ip_address) VALUES(?,?,?,?,?,?,?,?)",
         (ts, user_id, username, action, entity_type, entity_id, details_json, ip_address)
     )
 
+def log_actions(cur, entries, user=None):
+    """
+    Mehrere Audit-Einträge auf einmal (executemany).
+    entries: Liste von (action, entity_type, entity_id, details)
+    """
+    if not entries:
+        return
+    ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    user_id = user.get("id") if user else None
+    username = user.get("username") if user else None
+    cur.executemany(
+        "INSERT INTO audit_log(ts, user_id, username, action, entity_type, entity_id, details, ip_address) VALUES(?,?,?,?,?,?,?,?)",
+        [(ts, user_id, username, action, entity_type, entity_id,
+          json.dumps(details, ensure_ascii=False) if isinstance(details, dict) else details, None)
+         for action, entity_type, entity_id, details in entries]
+    )
+
+
+def apply_updates(cur, table, updates):
+    """
+    Schreibt nur geänderte Felder. updates: Liste von (id, {feld: neuer_wert}).
+    Gleiche Feld-Kombinationen werden zu einem executemany zusammengefasst.
+    """
+    groups = {}
+    for _id, changes in updates:
+        fields = tuple(sorted(changes))
+        groups.setdefault(fields, []).append(tuple(changes[f] for f in fields) + (_id,))
+    for fields, rows in groups.items():
+        set_sql = ", ".join(f"{f}=?" for f in fields)
+        cur.executemany(f"UPDATE {table} SET {set_sql} WHERE id=?", rows)
+
+
+def diff_fields(row, new):
+    """Felder aus `new`, die sich gegenüber der DB-Zeile `row` unterscheiden"""
+    return {k: v for k, v in new.items() if row[k] != v}
+
+
+def rollup_sale(cur, ts, payment_method_id, total_cents, lines, sign=1, shift_id=None):
+    """
+    Verbucht einen Verkauf (sign=1) bzw. Storno (sign=-1) in den stündlichen Rollups
+    und – falls einer Schicht zugeordnet – in den Schicht-Summen.
+    lines: Iterable mit item_id, qty, total_cents
+    """
+    hour = ts[:13]
+    # Änderung an einem bereits abgeschlossenen Tag markieren
+    cur.execute(
+        "UPDATE day_closes SET changed_at=? WHERE day=? AND changed_at IS NULL",
+        (datetime.now().strftime("%Y-%m-%d %H:%M:%S"), ts[:10]),
+    )
+    if shift_id:
+        cur.execute(
+            "INSERT INTO shift_totals(shift_id, payment_method_id, sales, revenue_cents) VALUES(?,?,?,?) "
+            "ON CONFLICT(shift_id, payment_method_id) DO UPDATE SET "
+            "sales=sales+excluded.sales, revenue_cents=revenue_cents+excluded.revenue_cents",
+            (shift_id, payment_method_id, sign, sign * total_cents),
+        )
+    cur.execute(
+        "INSERT INTO rollup_hourly(hour, payment_method_id, sales, revenue_cents) VALUES(?,?,?,?) "
+        "ON CONFLICT(hour, payment_method_id) DO UPDATE SET "
+        "sales=sales+excluded.sales, revenue_cents=revenue_cents+excluded.revenue_cents",
+        (hour, payment_method_id, sign, sign * total_cents),
+    )
+    cur.executemany(
+        "INSERT INTO rollup_hourly_items(hour, item_id, qty, revenue_cents) VALUES(?,?,?,?) "
+        "ON CONFLICT(hour, item_id) DO UPDATE SET "
+        "qty=qty+excluded.qty, revenue_cents=revenue_cents+excluded.revenue_cents",
+        [(hour, ln["item_id"], sign * ln["qty"], sign * ln["total_cents"]) for ln in lines],
+    )
+
+
+def storno_sale(cur, sale_id, user_id=None):
+    """
+    Löscht einen Verkauf und bucht ihn aus Rollups, Schicht-Summen und Lagerbestand aus.
+    Der Header wird zuerst gelöscht: bei parallelen Stornos gewinnt genau einer, die anderen
+    erhalten None und buchen nichts doppelt aus. user_id schränkt auf eigene Verkäufe ein.
+    """
+    h = cur.execute(
+        "DELETE FROM sale_headers WHERE id=? AND (? IS NULL OR user_id=?) "
+        "RETURNING ts, payment_method_id, total_cents, shift_id",
+        (sale_id, user_id, user_id),
+    ).fetchone()
+    if not h:
+        return None
+    lines = cur.execute(
+        "SELECT item_id, qty, total_cents FROM sale_lines WHERE sale_id=?", (sale_id,)
+    ).fetchall()
+    cur.execute("DELETE FROM sale_items WHERE sale_id=?", (sale_id,))
+    rollup_sale(cur, h["ts"], h["payment_method_id"], h["total_cents"], lines, sign=-1, shift_id=h["shift_id"])
+    consume_stock(cur, lines, sign=-1)
+    return h
+
+
+# Ein Statement pro Verkauf: Positionen (JSON) über die Rezepte auf Lagerartikel auflösen,
+# Bestände der geführten Artikel anpassen und die neuen Stände zurückgeben.
+STOCK_UPDATE_SQL = """
+    WITH lines(item_id, qty) AS (
+        SELECT json_extract(value, '$[0]'), json_extract(value, '$[1]') FROM json_each(?)
+    ),
+    need(id, qty) AS (
+        SELECT COALESCE(r.component_id, l.item_id), SUM(l.qty * COALESCE(r.qty, 1))
+        FROM lines l LEFT JOIN item_components r ON r.item_id = l.item_id
+        GROUP BY 1
+    )
+    UPDATE items SET stock = stock - ? * need.qty
+    FROM need
+    WHERE items.id = need.id AND items.stock IS NOT NULL
+    RETURNING items.id, items.stock, items.low_stock
+"""
+
+
+def consume_stock(cur, lines, sign=1):
+    """Bucht den Lagerverbrauch eines Verkaufs (sign=-1: Storno) und pflegt die Lagerwarnungen."""
+    rows = cur.execute(
+        STOCK_UPDATE_SQL, (json.dumps([[ln["item_id"], ln["qty"]] for ln in lines]), sign)
+    ).fetchall()
+    if rows:
+        update_stock_alerts(cur, rows)
+
+
+def update_stock_alerts(cur, rows):
+    """Öffnet Warnungen für Artikel auf/unter der Schwelle, schliesst sie darüber (rows: id, stock, low_stock)."""
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    low = [(r["id"], now, r["stock"]) for r in rows if r["stock"] is not None and r["stock"] <= r["low_stock"]]
+    ok = [(now, r["id"]) for r in rows if r["stock"] is None or r["stock"] > r["low_stock"]]
+    if low:
+        cur.executemany("INSERT OR IGNORE INTO stock_alerts(item_id, ts, stock) VALUES(?,?,?)", low)
+    if ok:
+        cur.executemany("UPDATE stock_alerts SET resolved_at=? WHERE item_id=? AND resolved_at IS NULL", ok)
+
+
+def load_stock_alerts(c):
+    return [dict(r) for r in c.execute(
+        """
+        SELECT a.id, a.item_id, i.name, a.ts, i.stock, i.low_stock
+        FROM stock_alerts a JOIN items i ON i.id = a.item_id
+        WHERE a.resolved_at IS NULL
+        ORDER BY a.id
+        """
+    ).fetchall()]
+
+
+def open_shift_id(cur, user_id, now, opening_cash_cents=0):
+    """ID der offenen Schicht des Benutzers; eröffnet bei Bedarf eine neue."""
+    row = cur.execute(
+        "SELECT id FROM shifts WHERE user_id=? AND closed_at IS NULL", (user_id,)
+    ).fetchone()
+    if row:
+        return row[0]
+    # OR IGNORE: eine parallele Anfrage desselben Benutzers kann die Schicht schon eröffnet haben
+    cur.execute(
+        "INSERT OR IGNORE INTO shifts(user_id, opened_at, opening_cash_cents) VALUES(?,?,?)",
+        (user_id, now, opening_cash_cents),
+    )
+    return cur.execute(
+        "SELECT id FROM shifts WHERE user_id=? AND closed_at IS NULL", (user_id,)
+    ).fetchone()[0]
+
+
+def catalog_version(c):
+    row = c.execute("SELECT value FROM meta WHERE key='catalog_version'").fetchone()
+    return int(row[0]) if row else 0
+
+
+def bump_catalog_version(cur):
+    """Erhöht die Katalog-Version, damit Kassen ihren lokalen Cache neu laden."""
+    cur.execute("UPDATE meta SET value=CAST(value AS INTEGER)+1 WHERE key='catalog_version'")
+
+
+def load_catalog(c):
+    """Aktive Artikel und Zahlarten in Kassen-Reihenfolge"""
+    items = [
+        dict(r)
+        for r in c.execute(
+            "SELECT id, name, price_cents / 100.0 AS price FROM items WHERE active=1 ORDER BY sort, id"
+        ).fetchall()
+    ]
+    # >>> Wichtig: protected mitgeben! <<<
+    pay_methods = [
+        dict(r)
+        for r in c.execute(
+            "SELECT id, name, protected FROM payment_methods WHERE active=1 ORDER BY sort, id"
+        ).fetchall()
+    ]
+    for pm in pay_methods: pm["protected"] = bool(pm["protected"])
+    return items, pay_methods
+
+
+# Katalog-Cache pro Prozess: unter gunicorn (preload_app) im Master vorgeladen und per
+# Copy-on-Write an die Worker vererbt; nach einer Katalogänderung lädt jeder Prozess neu.
+_catalog_cache = None  # (version, items, payment_methods)
+
+
+def cached_catalog(c, version):
+    global _catalog_cache
+    cache = _catalog_cache
+    if cache is None or cache[0] != version:
+        cache = _catalog_cache = (version, *load_catalog(c))
+    return cache[1], cache[2]
+
+
+# Hintergrund-Threads im gunicorn-Master greifen nur unter diesem Lock auf SQLite zu; fork()
+# wartet darauf, damit kein Worker einen gerade gesperrten SQLite-Mutex erbt (Deadlock).
+fork_lock = threading.Lock()
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(before=fork_lock.acquire, after_in_parent=fork_lock.release,
+                        after_in_child=fork_lock.release)
+
+
+def warm_caches():
+    """Startarbeit, die einmal im gunicorn-Master laufen soll (siehe gunicorn.conf.py)."""
+    c = conn()
+    cached_catalog(c, catalog_version(c))
+    c.close()
+
+
+def after_fork():
+    """Im Worker direkt nach dem Fork: prozessgebundene Ressourcen des Masters verwerfen."""
+    global _timer_watch_pid, _timer_streams
+    _timer_watch_pid, _timer_streams = None, 0  # Threads überleben den Fork nicht
+    c = conn()               # eigene Verbindung öffnen (SQLite-Handles nie über fork teilen)
+    c.execute("SELECT 1").fetchone()
+    c.close()
+    ensure_scheduler()       # Leerlauf-Jobs: jeder Worker bewirbt sich um die Lease
+
+
+def load_timers(c, user_id):
+    timers = [dict(r) for r in c.execute(
+        "SELECT id, label, duration_seconds, type, sound_enabled, sound_type FROM user_timers WHERE user_id=? ORDER BY id",
+        (user_id,)
+    ).fetchall()]
+    for t in timers:
+        t["sound_enabled"] = bool(t["sound_enabled"])
+    return timers
+
+
 def current_user():
     uid = session.get("user_id")
     if not uid:
@@ -204,6 +821,7 @@ def api_login():
     user_dict = {"id": u["id"], "username": u["username"]}
     log_action(cur, "login_success", user=user_dict, ip_address=ip_address)
     c.commit(); c.close()
+    ensure_scheduler()
     session["user_id"] = u["id"]
     return jsonify(ok=True, is_admin=bool(u["is_admin"]))
 
@@ -220,24 +838,36 @@ def index():
     user = current_user()
     if not user:
         return redirect(url_for("login_page"))
+    # Artikel/Zahlarten lädt die Kasse über /api/pos/bootstrap (mit lokalem Cache)
+    return render_template("pos.html", currency=CURRENCY, user=user)
+
+
+@app.route("/api/pos/bootstrap")
+def api_pos_bootstrap():
+    """
+    Alles, was die Kasse zum Start braucht, in einem Request.
+    Mit ?since=<version> werden Artikel/Zahlarten nur mitgeschickt, wenn sich
+    der Katalog seit dieser Version geändert hat.
+    """
+    user = current_user()
+    if not user:
+        return jsonify(ok=False, msg="Nicht angemeldet"), 401
+    since = request.args.get("since")
     c = conn()
-    items = [
-        dict(r)
-        for r in c.execute(
-            "SELECT id, name, price FROM items WHERE active=1 ORDER BY sort, id"
-        ).fetchall()
-    ]
-    # >>> Wichtig: protected mitgeben! <<<
-    pay_methods = [
-        dict(r)
-        for r in c.execute(
-            "SELECT id, name, protected FROM payment_methods WHERE active=1 ORDER BY sort, id"
-        ).fetchall()
-    ]
+    version = catalog_version(c)
+    doc = {
+        "ok": True,
+        "version": version,
+        "currency": CURRENCY,
+        "user": {"id": user["id"], "username": user["username"], "is_admin": bool(user["is_admin"])},
+        "timers": load_timers(c, user["id"]),
+    }
+    if since != str(version):
+        doc["items"], doc["payment_methods"] = cached_catalog(c, version)
     c.close()
-    return render_template(
-        "pos.html", items=items, currency=CURRENCY, user=user, pay_methods=pay_methods
-    )
+    resp = jsonify(doc)
+    resp.headers["Cache-Control"] = "no-store"
+    return resp
 
 
 @app.route("/admin")
@@ -251,6 +881,7 @@ def admin():
 # ---------- POS Actions ----------
 @app.route("/sale", methods=["POST"])
 def sale():
+    global _last_sale
     user = current_user()
     if not user:
         return jsonify(ok=False, msg="Nicht angemeldet"), 401
@@ -272,71 +903,93 @@ def sale():
     ).fetchone():
         c.close(); return jsonify(ok=False, msg="Ungültige Zahlart"), 400
 
-    cart_total = 0.0; norm_lines = []
+    wanted = []
     for line in lines:
         try:
-            item_id = int(line.get("item_id"))
+            wanted.append((int(line.get("item_id")), int(line.get("qty", 1))))
         except (TypeError, ValueError):
             continue
-        qty = int(line.get("qty", 1))
-        it = cur.execute(
-            "SELECT name, price FROM items WHERE id=? AND active=1", (item_id,)
-        ).fetchone()
+    # Alle Artikel des Warenkorbs in einer Abfrage
+    ids = sorted({item_id for item_id, _ in wanted})
+    found = {r["id"]: r for r in cur.execute(
+        "SELECT i.id, i.name, i.price_cents, "
+        "(SELECT MAX(v.id) FROM item_versions v WHERE v.item_id = i.id) AS version_id "
+        f"FROM items i WHERE i.active=1 AND i.id IN ({','.join('?' * len(ids))})", ids
+    ).fetchall()} if ids else {}
+
+    cart_total = 0; norm_lines = []  # in Rappen
+    for item_id, qty in wanted:
+        it = found.get(item_id)
         if not it:
             continue
-        name, price = it["name"], float(it["price"])
+        name, price = it["name"], it["price_cents"]
         total = qty * price
         cart_total += total
         norm_lines.append(
-            {"item_id": item_id, "item_name": name, "qty": qty, "price": price, "total": total}
+            {"item_id": item_id, "version_id": it["version_id"], "item_name": name, "qty": qty,
+             "price_cents": price, "total_cents": total}
         )
 
     if not norm_lines:
         c.close(); return jsonify(ok=False, msg="Keine gültigen Artikel"), 400
 
-    # Header
+    # Header (Verkauf ohne offene Schicht eröffnet automatisch eine)
+    shift_id = open_shift_id(cur, user["id"], now)
     cur.execute(
-        "INSERT INTO sale_headers(ts,user_id,payment_method_id,total) VALUES(?,?,?,?)",
-        (now, user["id"], payment_method_id, cart_total),
+        "INSERT INTO sale_headers(ts,user_id,payment_method_id,total_cents,shift_id) VALUES(?,?,?,?,?)",
+        (now, user["id"], payment_method_id, cart_total, shift_id),
     )
     sale_id = cur.lastrowid
 
-    # Lines + Kompatibilitätstabelle
-    for ln in norm_lines:
-        cur.execute(
-            "INSERT INTO sale_lines(sale_id,item_id,item_name,qty,price,total) VALUES(?,?,?,?,?,?)",
-            (sale_id, ln["item_id"], ln["item_name"], ln["qty"], ln["price"], ln["total"]),
-        )
-        cur.execute(
-            "INSERT INTO sales(ts,item_id,item_name,qty,price,total) VALUES(?,?,?,?,?,?)",
-            (now, ln["item_id"], ln["item_name"], ln["qty"], ln["price"], ln["total"]),
-        )
+    # Positionen: Artikelversion + Menge (Name/Preis/Total über die Views sale_lines und sales)
+    cur.executemany(
+        "INSERT INTO sale_items(sale_id,version_id,qty) VALUES(?,?,?)",
+        [(sale_id, ln["version_id"], ln["qty"]) for ln in norm_lines],
+    )
+
+    rollup_sale(cur, now, payment_method_id, cart_total, norm_lines, shift_id=shift_id)
+    consume_stock(cur, norm_lines)
 
     # Log sale creation
     pm_name = cur.execute("SELECT name FROM payment_methods WHERE id=?", (payment_method_id,)).fetchone()
     log_action(cur, "sale_create", entity_type="sale", entity_id=sale_id,
-               details={"total": cart_total, "payment_method": pm_name["name"] if pm_name else None},
+               details={"total": from_cents(cart_total), "payment_method": pm_name["name"] if pm_name else None},
                user=user)
 
     c.commit(); c.close()
-    return jsonify(ok=True, sale_id=sale_id, total=round(cart_total, 2))
+    _last_sale = time.time()  # nur echte Verkäufe zählen: Leerlauf-Jobs weichen dem Kassenbetrieb
+    ensure_scheduler()
+    return jsonify(ok=True, sale_id=sale_id, total=from_cents(cart_total))
 
 
 @app.route("/undo", methods=["POST"])
 def undo():
-    c = conn()
-    last = c.execute("SELECT id FROM sale_headers ORDER BY id DESC LIMIT 1").fetchone()
-    if not last:
+    """Storniert den letzten Verkauf des angemeldeten Benutzers (oder sale_id, falls eigener Verkauf)."""
+    user = current_user()
+    if not user:
+        return jsonify(ok=False, msg="Nicht angemeldet"), 401
+    data = request.get_json(silent=True) or {}
+    sale_id = data.get("sale_id")
+    if sale_id is not None:
+        try:
+            sale_id = int(sale_id)
+        except (TypeError, ValueError):
+            sale_id = 0
+        if sale_id <= 0:
+            return jsonify(ok=False, msg="Ungültige sale_id"), 400
+    c = conn(); cur = c.cursor()
+    if sale_id is None:
+        last = cur.execute(
+            "SELECT MAX(id) FROM sale_headers WHERE user_id=?", (user["id"],)
+        ).fetchone()
+        sale_id = last[0]
+    h = storno_sale(cur, sale_id, user_id=user["id"]) if sale_id else None
+    if not h:
         c.close(); return jsonify(ok=False, msg="Nichts zu löschen.")
-    sale_id = last[0]
-    ts_row = c.execute("SELECT ts FROM sale_headers WHERE id=?", (sale_id,)).fetchone()
-    ts = ts_row[0] if ts_row else None
-    c.execute("DELETE FROM sale_lines WHERE sale_id=?", (sale_id,))
-    c.execute("DELETE FROM sale_headers WHERE id=?", (sale_id,))
-    if ts:
-        c.execute("DELETE FROM sales WHERE ts=?", (ts,))
+    log_action(cur, "sale_undo", entity_type="sale", entity_id=sale_id,
+               details={"total": from_cents(h["total_cents"]), "ts": h["ts"]}, user=user)
     c.commit(); c.close()
-    return jsonify(ok=True)
+    return jsonify(ok=True, sale_id=sale_id)
 
 
 @app.route("/export.csv")
@@ -345,7 +998,7 @@ def export_csv():
     # Export jetzt auf Basis der normalisierten Tabellen inkl. sale_id
     rows = c.execute(
         """
-        SELECT h.id AS sale_id, h.ts, l.item_name, l.qty, l.price, l.total
+        SELECT h.id AS sale_id, h.ts, l.item_name, l.qty, l.price_cents, l.total_cents
         FROM sale_lines l
         JOIN sale_headers h ON h.id = l.sale_id
         ORDER BY h.id ASC, l.id ASC
@@ -357,43 +1010,60 @@ def export_csv():
     # Header inkl. SaleID
     w.writerow(["SaleID","Zeit","Artikel","Menge","Preis","Gesamt"])
     for r in rows:
-        w.writerow([r["sale_id"], r["ts"], r["item_name"], r["qty"], f"{r['price']:.2f}", f"{r['total']:.2f}"])
+        w.writerow([r["sale_id"], r["ts"], r["item_name"], r["qty"], f"{r['price_cents'] / 100:.2f}", f"{r['total_cents'] / 100:.2f}"])
     mem = io.BytesIO(buf.getvalue().encode("utf-8")); mem.seek(0)
     return send_file(mem, mimetype="text/csv", as_attachment=True, download_name="verkauf.csv")
 
 
-@app.route("/export_summary.csv")
-def export_summary_csv():
-    """Export der Tagesübersicht (per Item) als CSV"""
-    c = conn()
-    today = datetime.now().strftime("%Y-%m-%d")
-
-    per_item = c.execute(
-        "SELECT item_name, SUM(qty) as qty, SUM(total) as total FROM sales WHERE date(ts)=date('now','localtime') GROUP BY item_name ORDER BY qty DESC"
-    ).fetchall()
-
-    total_sum = sum(float(r["total"]) for r in per_item) if per_item else 0
-    count = c.execute("SELECT COUNT(DISTINCT ts) FROM sales WHERE date(ts)=date('now','localtime')").fetchone()[0]
-
-    c.close()
-
+def day_summary(c, day):
+    """Tagesaggregate (pro Artikel, pro Zahlart, Total, Transaktionen) für YYYY-MM-DD"""
+    rng = (day, day)
+    per_item = [dict(r) for r in c.execute(
+        "SELECT l.item_name, SUM(l.qty) AS qty, SUM(l.total_cents) AS total_cents "
+        "FROM sale_headers h JOIN sale_lines l ON l.sale_id=h.id "
+        "WHERE h.ts >= ? AND h.ts < date(?, '+1 day') "
+        "GROUP BY l.item_name ORDER BY qty DESC, l.item_name", rng
+    ).fetchall()]
+    # Gesamttotal nach Zahlungsart
+    per_payment = [dict(r) for r in c.execute(
+        "SELECT p.name AS payment_method, SUM(h.total_cents) AS total_cents "
+        "FROM sale_headers h "
+        "LEFT JOIN payment_methods p ON p.id = h.payment_method_id "
+        "WHERE h.ts >= ? AND h.ts < date(?, '+1 day') "
+        "GROUP BY h.payment_method_id "
+        "ORDER BY total_cents DESC", rng
+    ).fetchall()]
+    count, total_cents = c.execute(
+        "SELECT COUNT(*), COALESCE(SUM(total_cents), 0) FROM sale_headers WHERE ts >= ? AND ts < date(?, '+1 day')", rng
+    ).fetchone()
+    for r in per_item + per_payment:
+        r["total"] = from_cents(r.pop("total_cents"))
+    return {
+        "day": day,
+        "per_item": per_item,
+        "per_payment": per_payment,
+        "total": from_cents(total_cents),
+        "count": count,
+    }
+
+
+def render_summary_csv(summary):
     buf = io.StringIO(); w = csv.writer(buf, delimiter=';')
-    w.writerow([f"Tagesabschluss {today}"])
+    w.writerow([f"Tagesabschluss {summary['day']}"])
+    if summary.get("note"):
+        w.writerow([summary["note"]])
     w.writerow([])
     w.writerow(["Artikel","Menge","Gesamt"])
-    for r in per_item:
-        w.writerow([r["item_name"], r["qty"], f"{float(r['total']):.2f}"])
+    for r in summary["per_item"]:
+        w.writerow([r["item_name"], r["qty"], f"{r['total']:.2f}"])
     w.writerow([])
-    w.writerow(["TOTAL","", f"{total_sum:.2f} {CURRENCY}"])
-    w.writerow(["Transaktionen",count])
-
-    mem = io.BytesIO(buf.getvalue().encode("utf-8")); mem.seek(0)
-    return send_file(mem, mimetype="text/csv", as_attachment=True, download_name=f"tagesabschluss_{today}.csv")
+    w.writerow(["TOTAL","", f"{summary['total']:.2f} {CURRENCY}"])
+    w.writerow(["Transaktionen",summary["count"]])
+    return buf.getvalue().encode("utf-8")
 
 
-@app.route("/export_summary.pdf")
-def export_summary_pdf():
-    """Export der Tagesübersicht als schönes PDF"""
+def render_summary_pdf(summary):
+    """Tagesübersicht als schönes PDF (bytes); None falls reportlab fehlt"""
     try:
         from reportlab.lib.pagesizes import A4
         from reportlab.lib import colors
@@ -402,29 +1072,7 @@ def export_summary_pdf():
         from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
         from reportlab.lib.enums import TA_CENTER, TA_RIGHT
     except ImportError:
-        return jsonify(ok=False, msg="reportlab nicht installiert. Bitte 'pip install reportlab' ausführen"), 500
-
-    c = conn()
-    today = datetime.now().strftime("%Y-%m-%d")
-
-    per_item = c.execute(
-        "SELECT item_name, SUM(qty) as qty, SUM(total) as total FROM sales WHERE date(ts)=date('now','localtime') GROUP BY item_name ORDER BY qty DESC"
-    ).fetchall()
-
-    total_sum = sum(float(r["total"]) for r in per_item) if per_item else 0
-    count = c.execute("SELECT COUNT(DISTINCT ts) FROM sales WHERE date(ts)=date('now','localtime')").fetchone()[0]
-
-    # Gesamttotal nach Zahlungsart
-    per_payment = c.execute(
-        "SELECT p.name as payment_method, SUM(h.total) as total "
-        "FROM sale_headers h "
-        "LEFT JOIN payment_methods p ON p.id = h.payment_method_id "
-        "WHERE date(h.ts)=date('now','localtime') "
-        "GROUP BY h.payment_method_id "
-        "ORDER BY total DESC"
-    ).fetchall()
-
-    c.close()
+        return None
 
     # PDF erstellen
     buf = io.BytesIO()
@@ -436,20 +1084,23 @@ def export_summary_pdf():
     # Titel
     title_style = ParagraphStyle('CustomTitle', parent=styles['Heading1'], fontSize=24, textColor=colors.HexColor('#111'), alignment=TA_CENTER)
     story.append(Paragraph(f"Tagesabschluss", title_style))
-    story.append(Paragraph(f"{today}", styles['Normal']))
+    story.append(Paragraph(f"{summary['day']}", styles['Normal']))
+    if summary.get("note"):
+        note_style = ParagraphStyle('Note', parent=styles['Normal'], textColor=colors.HexColor('#b00020'))
+        story.append(Paragraph(summary["note"], note_style))
     story.append(Spacer(1, 1*cm))
 
     # Tabelle
     data = [['Artikel', 'Menge', 'Gesamt']]
-    for r in per_item:
-        data.append([r["item_name"], str(r["qty"]), f"{float(r['total']):.2f} {CURRENCY}"])
+    for r in summary["per_item"]:
+        data.append([r["item_name"], str(r["qty"]), f"{r['total']:.2f} {CURRENCY}"])
 
     # Leere Zeile
     data.append(['', '', ''])
 
     # Total
-    data.append(['TOTAL', '', f"{total_sum:.2f} {CURRENCY}"])
-    data.append(['Transaktionen', str(count), ''])
+    data.append(['TOTAL', '', f"{summary['total']:.2f} {CURRENCY}"])
+    data.append(['Transaktionen', str(summary["count"]), ''])
 
     table = Table(data, colWidths=[10*cm, 3*cm, 4*cm])
     table.setStyle(TableStyle([
@@ -470,15 +1121,15 @@ def export_summary_pdf():
     story.append(Spacer(1, 1*cm))
 
     # Zweite Tabelle: Gesamttotal nach Zahlungsart
-    if per_payment:
+    if summary["per_payment"]:
         subtitle_style = ParagraphStyle('Subtitle', parent=styles['Heading2'], fontSize=16, textColor=colors.HexColor('#111'))
         story.append(Paragraph("Gesamttotal nach Zahlungsart", subtitle_style))
         story.append(Spacer(1, 0.5*cm))
 
         payment_data = [['Zahlungsart', 'Gesamt']]
-        for r in per_payment:
+        for r in summary["per_payment"]:
             payment_method = r["payment_method"] if r["payment_method"] else "Unbekannt"
-            payment_data.append([payment_method, f"{float(r['total']):.2f} {CURRENCY}"])
+            payment_data.append([payment_method, f"{r['total']:.2f} {CURRENCY}"])
 
         payment_table = Table(payment_data, colWidths=[10*cm, 7*cm])
         payment_table.setStyle(TableStyle([
@@ -495,9 +1146,177 @@ def export_summary_pdf():
         story.append(payment_table)
 
     doc.build(story)
-    buf.seek(0)
+    return buf.getvalue()
 
-    return send_file(buf, mimetype="application/pdf", as_attachment=True, download_name=f"tagesabschluss_{today}.pdf")
+
+def report_day():
+    """?date=YYYY-MM-DD (Default heute); None bei ungültigem Datum"""
+    day = request.args.get("date") or datetime.now().strftime("%Y-%m-%d")
+    try:
+        # normalisiert (2026-1-5 -> 2026-01-05), sonst passen Dateinamen und Textvergleiche nicht
+        return datetime.strptime(day, "%Y-%m-%d").strftime("%Y-%m-%d")
+    except ValueError:
+        return None
+
+
+def day_close_path(day, ext):
+    return os.path.join(REPORTS_DIR, f"tagesabschluss_{day}.{ext}")
+
+
+def day_close_state(c, day):
+    """
+    (Snapshot gültig?, Hinweis) für die Exporte: der eingefrorene Z-Bericht wird nur ausgeliefert,
+    solange der Tag danach nicht mehr verändert wurde; sonst live mit Warnhinweis
+    """
+    row = c.execute("SELECT closed_at, changed_at FROM day_closes WHERE day=?", (day,)).fetchone()
+    if not row:
+        return False, None
+    if not row["changed_at"]:
+        return True, None
+    return False, f"Nachträglich geändert am {row['changed_at']} – weicht vom Abschluss vom {row['closed_at']} ab"
+
+
+@app.route("/export_summary.csv")
+def export_summary_csv():
+    """Export der Tagesübersicht (per Item) als CSV; abgeschlossene Tage direkt vom Snapshot"""
+    day = report_day()
+    if not day:
+        return jsonify(ok=False, msg="Ungültiges Datum"), 400
+    path = day_close_path(day, "csv")
+    c = conn()
+    frozen, note = day_close_state(c, day)
+    if frozen and os.path.exists(path):
+        c.close()
+        return send_file(path, mimetype="text/csv", as_attachment=True, download_name=f"tagesabschluss_{day}.csv")
+
+    summary = day_summary(c, day)
+    c.close()
+    if note:
+        summary["note"] = note
+    mem = io.BytesIO(render_summary_csv(summary)); mem.seek(0)
+    return send_file(mem, mimetype="text/csv", as_attachment=True, download_name=f"tagesabschluss_{day}.csv")
+
+
+@app.route("/export_summary.pdf")
+def export_summary_pdf():
+    """Export der Tagesübersicht als schönes PDF; abgeschlossene Tage direkt vom Snapshot"""
+    day = report_day()
+    if not day:
+        return jsonify(ok=False, msg="Ungültiges Datum"), 400
+    path = day_close_path(day, "pdf")
+    c = conn()
+    frozen, note = day_close_state(c, day)
+    if frozen and os.path.exists(path):
+        c.close()
+        return send_file(path, mimetype="application/pdf", as_attachment=True, download_name=f"tagesabschluss_{day}.pdf")
+
+    pdf = None if note else cached_report(c, f"pdf:{day}", sales_fingerprint(c, day))  # in Ruhephasen vorgerendert
+    if pdf is None:
+        summary = day_summary(c, day)
+        if note:
+            summary["note"] = note
+        pdf = render_summary_pdf(summary)
+    c.close()
+    if pdf is None:
+        return jsonify(ok=False, msg="reportlab nicht installiert. Bitte 'pip install reportlab' ausführen"), 500
+    buf = io.BytesIO(pdf); buf.seek(0)
+    return send_file(buf, mimetype="application/pdf", as_attachment=True, download_name=f"tagesabschluss_{day}.pdf")
+
+
+@app.route("/api/admin/day_close", methods=["POST"])
+def api_admin_day_close():
+    """
+    Tagesabschluss (Z-Bericht): friert die Tagesaggregate als unveränderlichen Snapshot ein
+    und legt CSV/PDF samt SHA-256 unter REPORTS_DIR ab. Ein Tag kann nur einmal abgeschlossen werden.
+    """
+    user = current_user()
+    if not user or not user.get("is_admin"):
+        return jsonify(ok=False, msg="Nicht berechtigt"), 403
+    data = request.get_json(silent=True) or {}
+    day = data.get("date") or datetime.now().strftime("%Y-%m-%d")
+    try:
+        day = datetime.strptime(str(day), "%Y-%m-%d").strftime("%Y-%m-%d")
+    except ValueError:
+        return jsonify(ok=False, msg="Ungültiges Datum"), 400
+
+    c = conn(); cur = c.cursor()
+    if cur.execute("SELECT 1 FROM day_closes WHERE day=?", (day,)).fetchone():
+        c.close()
+        return jsonify(ok=False, msg="Tag bereits abgeschlossen"), 409
+    # Vorberechnete Zusammenfassung/PDF nur, wenn sie exakt zum aktuellen Verkaufsstand passen
+    fingerprint = sales_fingerprint(c, day)
+    cached = cached_report(c, f"day:{day}", fingerprint)
+    summary = json.loads(cached) if cached else day_summary(c, day)
+    summary_json = json.dumps(summary, sort_keys=True, ensure_ascii=False)
+    artifacts = {"csv": render_summary_csv(summary),
+                 "pdf": cached_report(c, f"pdf:{day}", fingerprint) or render_summary_pdf(summary)}
+
+    hashes = {ext: hashlib.sha256(content).hexdigest() if content is not None else None
+              for ext, content in artifacts.items()}
+
+    # Dateien zuerst nur temporär schreiben (eindeutige Namen, falls zwei Abschlüsse gleichzeitig laufen);
+    # an ihren Platz kommen sie erst, wenn der Abschluss committet ist
+    tmps = {}
+
+    def discard():
+        for tmp in tmps.values():
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+
+    try:
+        os.makedirs(REPORTS_DIR, exist_ok=True)
+        for ext, content in artifacts.items():
+            if content is None:
+                continue
+            tmps[ext] = f"{day_close_path(day, ext)}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmps[ext], "wb") as f:
+                f.write(content)
+    except OSError as e:
+        discard(); c.close()
+        return jsonify(ok=False, msg=f"Z-Bericht konnte nicht gespeichert werden: {e}"), 500
+
+    # Ein gleichzeitiger zweiter Abschluss wartet auf die Schreibsperre, findet danach die Zeile vor
+    # und bekommt 409, statt die Dateien zu überschreiben
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    try:
+        cur.execute(
+            "INSERT INTO day_closes(day, closed_at, closed_by, data, data_sha256, csv_sha256, pdf_sha256) "
+            "VALUES(?,?,?,?,?,?,?) ON CONFLICT(day) DO NOTHING",
+            (day, now, user["id"], summary_json, hashlib.sha256(summary_json.encode("utf-8")).hexdigest(),
+             hashes["csv"], hashes["pdf"]),
+        )
+        if cur.rowcount == 0:
+            c.rollback(); discard()
+            return jsonify(ok=False, msg="Tag bereits abgeschlossen"), 409
+        log_action(cur, "day_close", entity_type="day_close", details={"day": day, "total": summary["total"],
+                   "count": summary["count"]}, user=user)
+        c.commit()
+    except sqlite3.Error:
+        c.rollback(); discard()
+        raise
+    finally:
+        c.close()
+    for ext, tmp in tmps.items():
+        os.replace(tmp, day_close_path(day, ext))  # atomar
+    return jsonify(ok=True, day=day, total=summary["total"], count=summary["count"],
+                   csv_sha256=hashes["csv"], pdf_sha256=hashes["pdf"])
+
+
+@app.route("/api/admin/day_closes")
+def api_admin_day_closes():
+    """Abgeschlossene Tage; changed_at gesetzt, wenn der Tag nach dem Abschluss verändert wurde"""
+    user = current_user()
+    if not user or not user.get("is_admin"):
+        return jsonify(ok=False, msg="Nicht berechtigt"), 403
+    c = conn()
+    rows = [dict(r) for r in c.execute(
+        "SELECT d.day, d.closed_at, u.username AS closed_by, d.data_sha256, d.csv_sha256, d.pdf_sha256, d.changed_at "
+        "FROM day_closes d LEFT JOIN users u ON u.id=d.closed_by ORDER BY d.day DESC LIMIT 60"
+    ).fetchall()]
+    c.close()
+    return jsonify(ok=True, days=rows)
 
 
 # ---------- Admin APIs ----------
@@ -508,32 +1327,38 @@ def api_delete_sale(sale_id):
     if not user or not user.get("is_admin"):
         return jsonify(ok=False, msg="Nicht berechtigt"), 403
     c = conn(); cur = c.cursor()
-    # Get sale details before deleting
-    sale = cur.execute("SELECT ts, total FROM sale_headers WHERE id=?", (sale_id,)).fetchone()
+    sale = storno_sale(cur, sale_id)
     if not sale:
         c.close()
         return jsonify(ok=False, msg="Verkauf nicht gefunden"), 404
-    ts = sale["ts"]
-    total = sale["total"]
-    # Delete from all tables
-    cur.execute("DELETE FROM sale_lines WHERE sale_id=?", (sale_id,))
-    cur.execute("DELETE FROM sale_headers WHERE id=?", (sale_id,))
-    cur.execute("DELETE FROM sales WHERE ts=?", (ts,))
     # Log the storno
     log_action(cur, "sale_delete", entity_type="sale", entity_id=sale_id,
-               details={"total": total, "ts": ts}, user=user)
+               details={"total": from_cents(sale["total_cents"]), "ts": sale["ts"]}, user=user)
     c.commit(); c.close()
     return jsonify(ok=True)
 
 @app.route("/api/items")
 def api_items_list():
     c = conn(); items = [dict(r) for r in c.execute(
-        "SELECT id,name,price,active,sort FROM items ORDER BY sort,id"
+        "SELECT id,name,price_cents / 100.0 AS price,active,sort FROM items ORDER BY sort,id"
     ).fetchall()]; c.close()
     for it in items: it["active"] = bool(it["active"])  # 0/1 -> True/False
     return jsonify(items=items)
 
 
+def parse_item(it):
+    """Normalisiert einen Artikel aus Admin-Payload oder Import (active=None: nicht mitgeschickt)"""
+    active = it.get("active")
+    if isinstance(active, str):
+        active = active.strip().lower() not in ("0", "false", "nein", "no", "")
+    return {
+        "name": (it.get("name") or "").strip(),
+        "price_cents": to_cents(it.get("price")),
+        "active": None if active is None else (1 if active else 0),
+        "sort": int(it.get("sort") or 0),
+    }
+
+
 @app.route("/api/items/bulk", methods=["POST"])
 def api_items_bulk():
     user = current_user()
@@ -542,32 +1367,110 @@ def api_items_bulk():
     if not isinstance(items, list):
         return jsonify(ok=False, msg="Invalid payload"), 400
     c = conn(); cur = c.cursor()
-    for it in items:
-        _id = it.get("id"); _delete = bool(it.get("delete"))
-        name = (it.get("name") or "").strip()
-        price = float(it.get("price") or 0)
-        active = 1 if it.get("active") else 0
-        sort = int(it.get("sort") or 0)
+    # Aktuellen Stand einmal laden und nur Änderungen schreiben
+    current = {r["id"]: r for r in cur.execute("SELECT id, name, price_cents, active, sort FROM items").fetchall()}
+    deletes, updates, inserts, audit = [], [], [], []
+    for n, it in enumerate(items, 1):
+        try:
+            _id = int(it["id"]) if it.get("id") else None
+            new = parse_item(it)
+        except (ValueError, TypeError) as e:
+            c.close()
+            return jsonify(ok=False, msg=f"Artikel {n} ({it.get('name') or '?'}): {e}"), 400
+        _delete = bool(it.get("delete"))
+        if new["active"] is None:  # nicht mitgeschickt -> bisherigen Wert behalten
+            new["active"] = current[_id]["active"] if _id in current else 1
         if _id and _delete:
-            cur.execute("DELETE FROM items WHERE id=?", (_id,))
-            log_action(cur, "item_delete", entity_type="item", entity_id=_id,
-                       details={"name": name}, user=user)
+            if _id in current:
+                deletes.append((_id,))
+                audit.append(("item_delete", "item", _id, {"name": new["name"]}))
         elif _id:
-            cur.execute(
-                "UPDATE items SET name=?, price=?, active=?, sort=? WHERE id=?",
-                (name, price, active, sort, _id),
-            )
-            log_action(cur, "item_update", entity_type="item", entity_id=_id,
-                       details={"name": name, "price": price}, user=user)
+            row = current.get(_id)
+            if not row:
+                continue
+            changes = diff_fields(row, new)
+            if changes:
+                updates.append((_id, changes))
+                audit.append(("item_update", "item", _id, {"name": new["name"], "price": from_cents(new["price_cents"]), "changed": sorted(changes)}))
         else:
-            cur.execute(
-                "INSERT INTO items(name, price, active, sort) VALUES(?,?,?,?)",
-                (name, price, active, sort),
-            )
-            new_id = cur.lastrowid
-            log_action(cur, "item_create", entity_type="item", entity_id=new_id,
-                       details={"name": name, "price": price}, user=user)
-    c.commit(); c.close(); return jsonify(ok=True)
+            inserts.append(new)
+    # Reihenfolge: Löschen, Ändern, Neu (frei gewordene Namen können wiederverwendet werden)
+    cur.executemany("DELETE FROM items WHERE id=?", deletes)
+    cur.executemany("DELETE FROM item_components WHERE item_id=?1 OR component_id=?1", deletes)
+    cur.executemany("DELETE FROM stock_alerts WHERE item_id=?", deletes)
+    apply_updates(cur, "items", updates)
+    for new in inserts:
+        cur.execute(
+            "INSERT INTO items(name, price_cents, active, sort) VALUES(?,?,?,?)",
+            (new["name"], new["price_cents"], new["active"], new["sort"]),
+        )
+        audit.append(("item_create", "item", cur.lastrowid, {"name": new["name"], "price": from_cents(new["price_cents"])}))
+    log_actions(cur, audit, user=user)
+    if audit:
+        bump_catalog_version(cur)
+    c.commit(); c.close(); return jsonify(ok=True, changed=len(audit))
+
+
+@app.route("/api/items/import", methods=["POST"])
+def api_items_import():
+    """
+    Katalog-Import (CSV oder JSON) in einer Transaktion, Abgleich über den Artikelnamen.
+    CSV: Spalten name;price[;active][;sort] (Trennzeichen ; oder ,), als Datei-Upload "file" oder Body.
+    JSON: {"items": [{name, price, active, sort}, ...]}
+    Mit deactivate_missing=1 werden Artikel, die im Import fehlen, deaktiviert (Saisonwechsel).
+    """
+    user = current_user()
+    if not user or not user.get("is_admin"):
+        return jsonify(ok=False, msg="Nicht berechtigt"), 403
+    data = request.get_json(silent=True)
+    try:
+        if data is not None:
+            rows = data.get("items", []) if isinstance(data, dict) else data
+            deactivate_missing = bool(data.get("deactivate_missing")) if isinstance(data, dict) else False
+        else:
+            f = request.files.get("file")
+            text = (f.read() if f else request.get_data()).decode("utf-8-sig")
+            dialect = csv.Sniffer().sniff(text.splitlines()[0] if text else ";", delimiters=";,")
+            rows = list(csv.DictReader(io.StringIO(text), dialect=dialect))
+            deactivate_missing = request.values.get("deactivate_missing") in ("1", "true", "yes")
+        if not isinstance(rows, list):
+            raise ValueError
+        parsed = {}
+        for it in rows:
+            it = {k.strip().lower(): v for k, v in it.items() if k}
+            if "sort" not in it:
+                it["sort"] = len(parsed)
+            new = parse_item(it)
+            if new["name"]:
+                parsed[new["name"]] = new  # letzter Eintrag pro Name gewinnt
+    except (ValueError, TypeError, AttributeError, csv.Error):
+        return jsonify(ok=False, msg="Import konnte nicht gelesen werden"), 400
+
+    c = conn(); cur = c.cursor()
+    current = {r["name"]: r for r in cur.execute("SELECT id, name, price_cents, active, sort FROM items").fetchall()}
+    inserts, updates = [], []
+    for name, new in parsed.items():
+        row = current.get(name)
+        if new["active"] is None:  # Spalte fehlt -> bisherigen Wert behalten
+            new["active"] = row["active"] if row else 1
+        if not row:
+            inserts.append((new["name"], new["price_cents"], new["active"], new["sort"]))
+        else:
+            changes = diff_fields(row, new)
+            if changes:
+                updates.append((row["id"], changes))
+    deactivated = []
+    if deactivate_missing:
+        deactivated = [(r["id"], {"active": 0}) for name, r in current.items() if name not in parsed and r["active"]]
+    cur.executemany("INSERT INTO items(name, price_cents, active, sort) VALUES(?,?,?,?)", inserts)
+    apply_updates(cur, "items", updates + deactivated)
+    result = {"created": len(inserts), "updated": len(updates), "deactivated": len(deactivated),
+              "unchanged": len(parsed) - len(inserts) - len(updates)}
+    if inserts or updates or deactivated:
+        log_action(cur, "item_import", entity_type="item", details=result, user=user)
+        bump_catalog_version(cur)
+    c.commit(); c.close()
+    return jsonify(ok=True, **result)
 
 
 @app.route("/api/payment_methods")
@@ -587,44 +1490,50 @@ def api_pm_bulk():
     if not isinstance(methods, list):
         return jsonify(ok=False, msg="Invalid payload"), 400
     c = conn(); cur = c.cursor()
+    current = {r["id"]: r for r in cur.execute(
+        "SELECT id, name, active, sort, protected FROM payment_methods"
+    ).fetchall()}
+    deletes, updates, inserts, audit = [], [], [], []
     for m in methods:
-        _id = m.get("id"); _delete = bool(m.get("delete"))
+        try:
+            _id = int(m["id"]) if m.get("id") else None
+            sort = int(m.get("sort") or 0)
+        except (ValueError, TypeError):
+            c.close()
+            return jsonify(ok=False, msg="Ungültige Daten"), 400
+        _delete = bool(m.get("delete"))
         name = (m.get("name") or "").strip()
         active = 1 if m.get("active") else 0
-        sort = int(m.get("sort") or 0)
         protected = 1 if m.get("protected") else 0
-        is_protected = False
-        if _id:
-            row = cur.execute("SELECT protected FROM payment_methods WHERE id=?", (_id,)).fetchone()
-            is_protected = bool(row[0]) if row else False
+        row = current.get(_id) if _id else None
+        is_protected = bool(row["protected"]) if row else False
         if _id and _delete:
-            if is_protected:  # Bar nicht löschen
+            if not row or is_protected:  # Bar nicht löschen
                 continue
-            cur.execute("DELETE FROM payment_methods WHERE id=?", (_id,))
-            log_action(cur, "payment_delete", entity_type="payment_method", entity_id=_id,
-                       details={"name": name}, user=user)
+            deletes.append((_id,))
+            audit.append(("payment_delete", "payment_method", _id, {"name": name}))
         elif _id:
+            if not row:
+                continue
             if is_protected:
-                cur.execute(
-                    "UPDATE payment_methods SET name=?, active=?, sort=? WHERE id=?",
-                    (name or "Bar", active, sort, _id),
-                )
+                new = {"name": name or "Bar", "active": active, "sort": sort}
             else:
-                cur.execute(
-                    "UPDATE payment_methods SET name=?, active=?, sort=?, protected=? WHERE id=?",
-                    (name, active, sort, protected, _id),
-                )
-            log_action(cur, "payment_update", entity_type="payment_method", entity_id=_id,
-                       details={"name": name}, user=user)
+                new = {"name": name, "active": active, "sort": sort, "protected": protected}
+            changes = diff_fields(row, new)
+            if changes:
+                updates.append((_id, changes))
+                audit.append(("payment_update", "payment_method", _id, {"name": name, "changed": sorted(changes)}))
         else:
-            cur.execute(
-                "INSERT INTO payment_methods(name,active,sort,protected) VALUES(?,?,?,?)",
-                (name, active, sort, protected),
-            )
-            new_id = cur.lastrowid
-            log_action(cur, "payment_create", entity_type="payment_method", entity_id=new_id,
-                       details={"name": name}, user=user)
-    c.commit(); c.close(); return jsonify(ok=True)
+            inserts.append((name, active, sort, protected))
+    cur.executemany("DELETE FROM payment_methods WHERE id=?", deletes)
+    apply_updates(cur, "payment_methods", updates)
+    for ins in inserts:
+        cur.execute("INSERT INTO payment_methods(name,active,sort,protected) VALUES(?,?,?,?)", ins)
+        audit.append(("payment_create", "payment_method", cur.lastrowid, {"name": ins[0]}))
+    log_actions(cur, audit, user=user)
+    if audit:
+        bump_catalog_version(cur)
+    c.commit(); c.close(); return jsonify(ok=True, changed=len(audit))
 
 
 @app.route("/api/users")
@@ -636,125 +1545,229 @@ def api_users_list():
     return jsonify(users=rows)
 
 
-@app.route("/api/users/bulk", methods=["POST"])
-def api_users_bulk():
-    current = current_user()
-    data = request.get_json(silent=True) or {}
-    users = data.get("users", [])
-    if not isinstance(users, list):
-        return jsonify(ok=False, msg="Invalid payload"), 400
+def hash_pins(pins):
+    """
+    PINs hashen – VOR der Schreib-Transaktion, damit der DB-Schreib-Lock nicht während des
+    (absichtlich langsamen, ~0.15 s pro PIN) Hashings gehalten wird. Erst bei grossen Importen
+    lohnt ein kurzlebiger Prozess-Pool; der startet per forkserver/spawn, denn ein fork aus
+    einem Worker mit mehreren Threads kann an fremden Locks hängen bleiben.
+    """
+    if len(pins) < 16:
+        return [generate_password_hash(p) for p in pins]
+    method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    try:
+        with ProcessPoolExecutor(max_workers=min(4, os.cpu_count() or 1),
+                                 mp_context=multiprocessing.get_context(method)) as ex:
+            return list(ex.map(generate_password_hash, pins, chunksize=4))
+    except Exception:
+        return [generate_password_hash(p) for p in pins]  # z.B. Pool nicht startbar -> seriell
+
+
+def save_users(users, current):
+    """
+    Gemeinsamer Schreibpfad für /api/users/bulk und den CSV-Import.
+    Hasht alle neuen PINs vorab und schreibt dann in einer kurzen Transaktion.
+    Gibt die Liste der Nutzer zurück, bei denen der Admin-Schutz gegriffen hat.
+    ValueError bei ungültigen Einträgen oder doppeltem Benutzernamen (nichts geschrieben).
+    """
+    entries = []
+    for u in users:
+        try:
+            _id = int(u["id"]) if u.get("id") else None
+        except (TypeError, ValueError):
+            raise ValueError(f"Ungültige Benutzer-ID: {u.get('id')!r}")
+        entries.append({
+            "id": _id,
+            "delete": bool(u.get("delete")),
+            "username": (u.get("username") or "").strip(),
+            "is_admin": 1 if u.get("is_admin") else 0,
+            "active": 1 if u.get("active") else 0,
+            "pin": (u.get("pin") or "").strip(),
+        })
+
+    # PINs hashen, bevor die DB angefasst wird (neue Benutzer ohne PIN -> 0000)
+    to_hash = [e for e in entries if not e["delete"] and (e["pin"] or not e["id"])]
+    for e, h in zip(to_hash, hash_pins([e["pin"] or "0000" for e in to_hash])):
+        e["pin_hash"] = h
 
     c = conn(); cur = c.cursor()
+    rows = {r["id"]: r for r in cur.execute(
+        "SELECT id, username, pin_hash, is_admin, active FROM users"
+    ).fetchall()}
 
     # Anzahl aktiver Admins ermitteln
-    admin_count = cur.execute(
-        "SELECT COUNT(*) FROM users WHERE is_admin=1 AND active=1"
-    ).fetchone()[0]
+    admin_count = sum(1 for r in rows.values() if r["is_admin"] and r["active"])
 
     skipped = []  # Nutzer, bei denen Admin-Schutz gegriffen hat
+    deletes, updates, inserts, audit = [], [], [], []
 
-    for u in users:
-        _id = u.get("id")
-        _delete = bool(u.get("delete"))
-        username = (u.get("username") or "").strip()
-        is_admin_new = 1 if u.get("is_admin") else 0
-        active_new = 1 if u.get("active") else 0
-        new_pin = (u.get("pin") or "").strip()
-
-        if _id and _delete:
-            row = cur.execute("SELECT username,is_admin,active FROM users WHERE id=?", (_id,)).fetchone()
+    for e in entries:
+        _id = e["id"]
+        if _id and e["delete"]:
+            row = rows.get(_id)
             if not row:
                 continue
             was_admin_active = bool(row["is_admin"]) and bool(row["active"])
             if was_admin_active and admin_count <= 1:
                 skipped.append(row["username"] or f"#{_id}")
                 continue
-            cur.execute("DELETE FROM users WHERE id=?", (_id,))
-            log_action(cur, "user_delete", entity_type="user", entity_id=_id,
-                       details={"username": row["username"]}, user=current)
+            deletes.append((_id,))
+            audit.append(("user_delete", "user", _id, {"username": row["username"]}))
             if was_admin_active:
                 admin_count -= 1
             continue
 
         if _id:
-            row = cur.execute("SELECT username,is_admin,active FROM users WHERE id=?", (_id,)).fetchone()
+            row = rows.get(_id)
             if not row:
                 continue
             was_admin_active = bool(row["is_admin"]) and bool(row["active"])
-            will_be_admin_active = bool(is_admin_new) and bool(active_new)
+            will_be_admin_active = bool(e["is_admin"]) and bool(e["active"])
+            new = {"username": e["username"], "is_admin": e["is_admin"], "active": e["active"]}
+            if "pin_hash" in e:
+                new["pin_hash"] = e["pin_hash"]
 
             # Würde diese Änderung den letzten aktiven Admin "verlieren"?
             if was_admin_active and not will_be_admin_active and admin_count <= 1:
                 # Admin-/Aktiv-Flags erzwingen, damit mindestens 1 Admin bleibt
                 skipped.append(row["username"] or f"#{_id}")
-                if new_pin:
-                    cur.execute(
-                        "UPDATE users SET username=?, is_admin=1, active=1, pin_hash=? WHERE id=?",
-                        (username, generate_password_hash(new_pin), _id),
-                    )
-                else:
-                    cur.execute(
-                        "UPDATE users SET username=?, is_admin=1, active=1 WHERE id=?",
-                        (username, _id),
-                    )
+                new.update(is_admin=1, active=1)
+                changes = diff_fields(row, new)
+                if changes:
+                    updates.append((_id, changes))
                 # admin_count bleibt unverändert (weiterhin Admin aktiv)
                 continue
 
             # Änderungen sind erlaubt -> ggf. Zähler anpassen
-            became_admin_active = (not was_admin_active) and will_be_admin_active
-            left_admin_active = was_admin_active and (not will_be_admin_active)
-            if became_admin_active:
+            if (not was_admin_active) and will_be_admin_active:
                 admin_count += 1
-            if left_admin_active:
+            if was_admin_active and (not will_be_admin_active):
                 admin_count -= 1
 
-            if new_pin:
-                cur.execute(
-                    "UPDATE users SET username=?, is_admin=?, active=?, pin_hash=? WHERE id=?",
-                    (username, is_admin_new, active_new, generate_password_hash(new_pin), _id),
-                )
-            else:
-                cur.execute(
-                    "UPDATE users SET username=?, is_admin=?, active=? WHERE id=?",
-                    (username, is_admin_new, active_new, _id),
-                )
-            log_action(cur, "user_update", entity_type="user", entity_id=_id,
-                       details={"username": username}, user=current)
+            changes = diff_fields(row, new)
+            if changes:
+                updates.append((_id, changes))
+                audit.append(("user_update", "user", _id, {"username": e["username"]}))
             continue
 
         # Neuer Benutzer
-        if not new_pin:
-            new_pin = "0000"
-        cur.execute(
-            "INSERT INTO users(username,pin_hash,is_admin,active) VALUES(?,?,?,?)",
-            (username, generate_password_hash(new_pin), is_admin_new, active_new),
-        )
-        new_id = cur.lastrowid
-        log_action(cur, "user_create", entity_type="user", entity_id=new_id,
-                   details={"username": username}, user=current)
-        if is_admin_new and active_new:
+        inserts.append(e)
+        if e["is_admin"] and e["active"]:
             admin_count += 1
 
-    c.commit(); c.close()
+    # Kurze Schreibphase: Löschen, Ändern, Neu
+    try:
+        cur.executemany("DELETE FROM users WHERE id=?", deletes)
+        apply_updates(cur, "users", updates)
+        for e in inserts:
+            cur.execute(
+                "INSERT INTO users(username,pin_hash,is_admin,active) VALUES(?,?,?,?)",
+                (e["username"], e["pin_hash"], e["is_admin"], e["active"]),
+            )
+            audit.append(("user_create", "user", cur.lastrowid, {"username": e["username"]}))
+        log_actions(cur, audit, user=current)
+        c.commit()
+    except sqlite3.IntegrityError:
+        c.rollback()
+        raise ValueError("Benutzername mehrfach vergeben")
+    finally:
+        c.close()
+    return skipped
+
+
+@app.route("/api/users/bulk", methods=["POST"])
+def api_users_bulk():
+    current = current_user()
+    data = request.get_json(silent=True) or {}
+    users = data.get("users", [])
+    if not isinstance(users, list):
+        return jsonify(ok=False, msg="Invalid payload"), 400
+    try:
+        skipped = save_users(users, current)
+    except ValueError as e:
+        return jsonify(ok=False, msg=str(e)), 400
     # Optional: Warnungen zurückgeben (Frontend nutzt aktuell nur ok)
     return jsonify(ok=True, warn=(skipped if skipped else None))
 
 
-@app.route("/api/admin/summary")
-def api_admin_summary():
+@app.route("/api/users/import", methods=["POST"])
+def api_users_import():
+    """
+    CSV-Import von Benutzern (Spalten username;pin[;is_admin][;active], Trennzeichen ; oder ,).
+    Bestehende Benutzer (gleicher Username) werden aktualisiert, PIN und Flags nur falls angegeben.
+    """
+    current = current_user()
+    if not current or not current.get("is_admin"):
+        return jsonify(ok=False, msg="Nicht berechtigt"), 403
+    f = request.files.get("file")
+    try:
+        text = (f.read() if f else request.get_data()).decode("utf-8-sig")
+        dialect = csv.Sniffer().sniff(text.splitlines()[0] if text else ";", delimiters=";,")
+        rows = [{k.strip().lower(): (v or "").strip() for k, v in r.items() if k}
+                for r in csv.DictReader(io.StringIO(text), dialect=dialect)]
+    except (ValueError, csv.Error):
+        return jsonify(ok=False, msg="Import konnte nicht gelesen werden"), 400
+
+    def flag(v, default):
+        return default if v == "" or v is None else v.lower() not in ("0", "false", "nein", "no")
+
     c = conn()
+    existing = {r["username"]: r for r in c.execute("SELECT id, username, is_admin, active FROM users").fetchall()}
+    c.close()
+    users = {}
+    for r in rows:
+        username = r.get("username") or ""
+        if not username:
+            continue
+        # Fehlende Spalte/leerer Wert: bestehende Benutzer behalten ihre Rechte, neue bekommen die Defaults
+        old = existing.get(username)
+        users[username] = {  # letzter Eintrag pro Username gewinnt
+            "id": old["id"] if old else None,
+            "username": username,
+            "pin": r.get("pin") or "",
+            "is_admin": flag(r.get("is_admin"), bool(old["is_admin"]) if old else False),
+            "active": flag(r.get("active"), bool(old["active"]) if old else True),
+        }
+    users = list(users.values())
+    try:
+        skipped = save_users(users, current)
+    except ValueError as e:
+        return jsonify(ok=False, msg=str(e)), 400
+    created = sum(1 for u in users if not u["id"])
+    return jsonify(ok=True, created=created, updated=len(users) - created, warn=(skipped if skipped else None))
+
+
+def admin_summary(c, day):
+    """Einzelposten, Summe pro Artikel, Total und Anzahl eines Tages für /api/admin/summary"""
     rows = [
         dict(r)
         for r in c.execute(
-            "SELECT ts, item_name, qty, price, total FROM sales WHERE date(ts)=date('now','localtime') ORDER BY id DESC"
+            "SELECT ts, item_name, qty, price_cents / 100.0 AS price, total_cents / 100.0 AS total "
+            "FROM sales WHERE date(ts)=? ORDER BY id DESC", (day,)
         ).fetchall()
     ]
     per_item = [
         dict(r)
         for r in c.execute(
-            "SELECT item_name, SUM(qty) as qty, SUM(total) as total FROM sales WHERE date(ts)=date('now','localtime') GROUP BY item_name ORDER BY qty DESC"
+            "SELECT item_name, SUM(qty) as qty, SUM(total_cents) / 100.0 as total FROM sales WHERE date(ts)=? GROUP BY item_name ORDER BY qty DESC", (day,)
         ).fetchall()
     ]
+    # Summe exakt in Rappen, Anzahl Transaktionen wie in day_summary aus den Belegköpfen
+    total_cents, count = c.execute(
+        "SELECT COALESCE(SUM(total_cents), 0), COUNT(*) FROM sale_headers WHERE ts >= ? AND ts < date(?, '+1 day')",
+        (day, day),
+    ).fetchone()
+    return {"rows": rows, "per_item": per_item, "total_cents": total_cents, "count": count}
+
+
+@app.route("/api/admin/summary")
+def api_admin_summary():
+    day = datetime.now().strftime("%Y-%m-%d")
+    c = conn()
+    # In Ruhephasen vorberechnet (job_summary); sonst wie bisher direkt aggregieren
+    cached = cached_report(c, f"summary:{day}", sales_fingerprint(c, day))
+    summary = json.loads(cached) if cached else admin_summary(c, day)
+    closed = c.execute("SELECT closed_at, changed_at FROM day_closes WHERE day=?", (day,)).fetchone()
     # Neu: letzte 5 Bestellungen (Einzelposten, farblich gruppierbar via sale_id)
     last_ids = [r["id"] for r in c.execute(
         "SELECT id FROM sale_headers ORDER BY id DESC LIMIT 5"
@@ -763,8 +1776,8 @@ def api_admin_summary():
     if last_ids:
         q_marks = ",".join(["?"] * len(last_ids))
         last5_rows = [dict(r) for r in c.execute(
-            f"SELECT l.sale_id as sale_id, h.ts, l.item_name, l.qty, l.price, l.total, "
-            f"u.username as user, p.name as payment_method "
+            f"SELECT l.sale_id as sale_id, h.ts, l.item_name, l.qty, l.price_cents / 100.0 AS price, "
+            f"l.total_cents / 100.0 AS total, u.username as user, p.name as payment_method "
             f"FROM sale_lines l "
             f"JOIN sale_headers h ON h.id=l.sale_id "
             f"LEFT JOIN users u ON u.id=h.user_id "
@@ -772,33 +1785,34 @@ def api_admin_summary():
             f"WHERE h.id IN ({q_marks}) "
             f"ORDER BY h.id DESC, l.id ASC", last_ids
         ).fetchall()]
-        for r in last5_rows:
-            r["price"] = float(r["price"])
-            r["total"] = float(r["total"])
 
-    total = sum(r["total"] for r in rows) if rows else 0
-    distinct_ts = {r["ts"] for r in rows}
-    count = len(distinct_ts)
     c.close()
     return jsonify(
         ok=True,
-        date_label=datetime.now().strftime("%Y-%m-%d"),
-        rows=rows,
-        per_item=per_item,
+        date_label=day,
+        rows=summary["rows"],
+        per_item=summary["per_item"],
         last5_rows=last5_rows,  # neu
-        total=round(total, 2),
-        count=count,
+        total=from_cents(summary["total_cents"]),
+        count=summary["count"],
         currency=CURRENCY,
+        closed_at=closed["closed_at"] if closed else None,
+        changed_at=closed["changed_at"] if closed else None,
     )
 
 
 # Neuer Endpoint: verfügbare Tage (max. 5) mit vorhandenen Verkäufen
+def available_days(c):
+    return [dict(date=r["d"], count=r["cnt"]) for r in c.execute(
+        "SELECT date(ts) AS d, COUNT(*) AS cnt FROM sale_headers GROUP BY d ORDER BY d DESC LIMIT 5"
+    ).fetchall()]
+
+
 @app.route("/api/admin/available_days")
 def api_admin_available_days():
     c = conn()
-    days = [dict(date=r["d"], count=r["cnt"]) for r in c.execute(
-        "SELECT date(ts) AS d, COUNT(*) AS cnt FROM sale_headers GROUP BY d ORDER BY d DESC LIMIT 5"
-    ).fetchall()]
+    cached = cached_report(c, "available_days", sales_fingerprint(c))
+    days = json.loads(cached) if cached else available_days(c)
     c.close()
     return jsonify(ok=True, days=days)
 
@@ -845,7 +1859,7 @@ def api_admin_purchases():
     if group:
         # Lade Header (chronologisch neueste zuerst)
         headers = [dict(r) for r in c.execute(
-            "SELECT h.id, h.ts, h.user_id, h.payment_method_id, h.total, u.username as user, p.name as payment_method "
+            "SELECT h.id, h.ts, h.user_id, h.payment_method_id, h.total_cents, u.username as user, p.name as payment_method "
             "FROM sale_headers h "
             "LEFT JOIN users u ON u.id=h.user_id "
             "LEFT JOIN payment_methods p ON p.id=h.payment_method_id "
@@ -854,7 +1868,7 @@ def api_admin_purchases():
         ).fetchall()]
         # Alle passenden lines in gespeicherter Reihenfolge (l.id) holen
         lines_rows = [dict(r) for r in c.execute(
-            "SELECT l.sale_id, l.item_name, l.qty, l.price, l.total "
+            "SELECT l.sale_id, l.item_name, l.qty, l.price_cents / 100.0 AS price, l.total_cents / 100.0 AS total "
             "FROM sale_lines l JOIN sale_headers h ON h.id=l.sale_id "
             f"{where_sql.replace('h.','h.')} "  # reuse same filters (h.)
             "ORDER BY l.id ASC", params
@@ -871,15 +1885,15 @@ def api_admin_purchases():
                 "ts": h["ts"],
                 "user": h.get("user"),
                 "payment_method": h.get("payment_method"),
-                "total": float(h["total"]),
+                "total": from_cents(h["total_cents"]),
                 "lines": grouped.get(h["id"], [])
             })
         return jsonify(ok=True, grouped=True, purchases=purchases, currency=CURRENCY)
     else:
         # Einzelne Posten: jede sale_lines Zeile mit Header-Infos
         rows = [dict(r) for r in c.execute(
-            "SELECT l.sale_id as sale_id, h.ts, l.item_name, l.qty, l.price, l.total, "
-            "u.username as user, p.name as payment_method "
+            "SELECT l.sale_id as sale_id, h.ts, l.item_name, l.qty, l.price_cents / 100.0 AS price, "
+            "l.total_cents / 100.0 AS total, u.username as user, p.name as payment_method "
             "FROM sale_lines l "
             "JOIN sale_headers h ON h.id=l.sale_id "
             "LEFT JOIN users u ON u.id=h.user_id "
@@ -888,12 +1902,375 @@ def api_admin_purchases():
             "ORDER BY h.id DESC, l.id ASC", params
         ).fetchall()]
         c.close()
-        for r in rows:
-            r['total'] = float(r['total'])
         return jsonify(ok=True, grouped=False, rows=rows, currency=CURRENCY)
 
 
+# Heatmap: Umsatz/Anzahl nach Wochentag x Stunde, aus den stündlichen Rollups
+@app.route("/api/admin/analytics/heatmap")
+def api_admin_heatmap():
+    """
+    ?start=YYYY-MM-DD&end=YYYY-MM-DD (Default: letzte 365 Tage)
+    &breakdown=item|payment_method (optional, zusätzlich eine Serie pro Artikel/Zahlart)
+    weekday: 0=Montag … 6=Sonntag, hour: 0–23
+    """
+    user = current_user()
+    if not user or not user.get("is_admin"):
+        return jsonify(ok=False, msg="Nicht berechtigt"), 403
+    end = request.args.get('end') or datetime.now().date().isoformat()
+    start = request.args.get('start') or (datetime.now() - timedelta(days=364)).date().isoformat()
+    breakdown = request.args.get('breakdown')
+    try:
+        start = datetime.strptime(start, "%Y-%m-%d").strftime("%Y-%m-%d")
+        end = datetime.strptime(end, "%Y-%m-%d").strftime("%Y-%m-%d")
+    except ValueError:
+        return jsonify(ok=False, msg="Ungültiger Zeitraum"), 400
+    if breakdown not in (None, "", "item", "payment_method"):
+        return jsonify(ok=False, msg="Ungültiges breakdown"), 400
+
+    # strftime('%w'): 0=Sonntag -> auf 0=Montag umrechnen
+    bucket = ("(CAST(strftime('%w', substr(r.hour,1,10)) AS INTEGER)+6)%7 AS weekday, "
+              "CAST(substr(r.hour,12,2) AS INTEGER) AS hour")
+    where = "r.hour >= ? AND r.hour < date(?, '+1 day')"
+    params = (start, end)
+
+    c = conn()
+    cells = {}
+    for r in c.execute(
+        f"SELECT {bucket}, SUM(r.sales) AS sales, SUM(r.revenue_cents) AS revenue_cents "
+        f"FROM rollup_hourly r WHERE {where} GROUP BY 1, 2", params
+    ).fetchall():
+        cells[(r["weekday"], r["hour"])] = {"weekday": r["weekday"], "hour": r["hour"], "sales": r["sales"],
+                                            "revenue": from_cents(r["revenue_cents"]), "qty": 0}
+    for r in c.execute(
+        f"SELECT {bucket}, SUM(r.qty) AS qty FROM rollup_hourly_items r WHERE {where} GROUP BY 1, 2", params
+    ).fetchall():
+        cells.setdefault((r["weekday"], r["hour"]), {"weekday": r["weekday"], "hour": r["hour"], "sales": 0,
+                                                     "revenue": 0.0, "qty": 0})["qty"] = r["qty"]
+
+    series = None
+    if breakdown == "item":
+        series = {}
+        for r in c.execute(
+            f"SELECT r.item_id AS id, i.name, {bucket}, SUM(r.qty) AS qty, SUM(r.revenue_cents) AS revenue_cents "
+            f"FROM rollup_hourly_items r LEFT JOIN items i ON i.id=r.item_id "
+            f"WHERE {where} GROUP BY r.item_id, 3, 4", params
+        ).fetchall():
+            s = series.setdefault(r["id"], {"id": r["id"], "name": r["name"] or f"#{r['id']}", "cells": []})
+            s["cells"].append({"weekday": r["weekday"], "hour": r["hour"], "qty": r["qty"],
+                               "revenue": from_cents(r["revenue_cents"])})
+    elif breakdown == "payment_method":
+        series = {}
+        for r in c.execute(
+            f"SELECT r.payment_method_id AS id, p.name, {bucket}, SUM(r.sales) AS sales, SUM(r.revenue_cents) AS revenue_cents "
+            f"FROM rollup_hourly r LEFT JOIN payment_methods p ON p.id=r.payment_method_id "
+            f"WHERE {where} GROUP BY r.payment_method_id, 3, 4", params
+        ).fetchall():
+            s = series.setdefault(r["id"], {"id": r["id"], "name": r["name"] or f"#{r['id']}", "cells": []})
+            s["cells"].append({"weekday": r["weekday"], "hour": r["hour"], "sales": r["sales"],
+                               "revenue": from_cents(r["revenue_cents"])})
+    c.close()
+
+    return jsonify(
+        ok=True, start=start, end=end, currency=CURRENCY,
+        cells=sorted(cells.values(), key=lambda x: (x["weekday"], x["hour"])),
+        breakdown=(list(series.values()) if series is not None else None),
+    )
+
+
+# ---------- Live-Streams ----------
+# Ein offener Stream hält seinen Worker-Thread für die ganze Verbindung. Über STREAM_SLOTS hinaus
+# gibt es 503 und der Client fragt per Polling ab – so bleibt immer ein Thread für /sale frei.
+_stream_slots = threading.Semaphore(STREAM_SLOTS)
+
+
+def event_stream(generate):
+    """SSE-Antwort aus dem Generator, sofern ein Stream-Slot frei ist."""
+    if not _stream_slots.acquire(blocking=False):
+        return jsonify(ok=False, msg="Live-Updates nicht verfügbar"), 503
+    resp = Response(stream_with_context(generate), mimetype="text/event-stream")
+    resp.call_on_close(_stream_slots.release)
+    resp.headers["Cache-Control"] = "no-store"
+    resp.headers["X-Accel-Buffering"] = "no"
+    return resp
+
+
+# ---------- Lager ----------
+def parse_int(value, default=None):
+    if value is None or value == "":
+        return default
+    return int(value)
+
+
+@app.route("/api/admin/stock")
+def api_admin_stock():
+    user = current_user()
+    if not user or not user.get("is_admin"):
+        return jsonify(ok=False, msg="Nicht berechtigt"), 403
+    c = conn()
+    items = [dict(r) for r in c.execute(
+        "SELECT id, name, active, stock, low_stock FROM items ORDER BY sort, id"
+    ).fetchall()]
+    components = {}
+    for r in c.execute("SELECT item_id, component_id, qty FROM item_components ORDER BY item_id, component_id"):
+        components.setdefault(r["item_id"], []).append({"id": r["component_id"], "qty": r["qty"]})
+    for it in items:
+        it["active"] = bool(it["active"])
+        it["components"] = components.get(it["id"], [])
+    alerts = load_stock_alerts(c)
+    c.close()
+    return jsonify(ok=True, items=items, alerts=alerts)
+
+
+@app.route("/api/admin/stock/bulk", methods=["POST"])
+def api_admin_stock_bulk():
+    """
+    Bestände, Warnschwellen und Rezepte setzen.
+    items: [{id, stock (null = nicht geführt), add (Zugang), low_stock, components: [{id, qty}]}]
+    """
+    user = current_user()
+    if not user or not user.get("is_admin"):
+        return jsonify(ok=False, msg="Nicht berechtigt"), 403
+    data = request.get_json(silent=True) or {}
+    items = data.get("items", [])
+    if not isinstance(items, list):
+        return jsonify(ok=False, msg="Invalid payload"), 400
+    c = conn(); cur = c.cursor()
+    current = {r["id"]: r for r in cur.execute("SELECT id, name, stock, low_stock FROM items").fetchall()}
+    updates, recipes, audit = [], [], []
+    try:
+        for it in items:
+            row = current.get(int(it.get("id") or 0))
+            if not row:
+                continue
+            new = {"stock": row["stock"], "low_stock": row["low_stock"]}
+            if "stock" in it:
+                new["stock"] = parse_int(it["stock"])
+            if parse_int(it.get("add")):
+                new["stock"] = (new["stock"] or 0) + int(it["add"])
+            if "low_stock" in it:
+                new["low_stock"] = max(0, parse_int(it["low_stock"], 0))
+            changes = diff_fields(row, new)
+            if changes:
+                updates.append((row["id"], changes))
+                audit.append(("stock_update", "item", row["id"], {"name": row["name"], **new}))
+            if isinstance(it.get("components"), list):
+                comps = {}
+                for comp in it["components"]:
+                    comp_id, qty = int(comp.get("id")), parse_int(comp.get("qty"), 1)
+                    if comp_id in current and comp_id != row["id"] and qty > 0:
+                        comps[comp_id] = qty
+                recipes.append((row["id"], comps))
+    except (TypeError, ValueError):
+        c.close(); return jsonify(ok=False, msg="Ungültige Zahl"), 400
+
+    apply_updates(cur, "items", updates)
+    for item_id, comps in recipes:
+        old = {r["component_id"]: r["qty"] for r in cur.execute(
+            "SELECT component_id, qty FROM item_components WHERE item_id=?", (item_id,)
+        ).fetchall()}
+        if old == comps:
+            continue
+        cur.execute("DELETE FROM item_components WHERE item_id=?", (item_id,))
+        cur.executemany(
+            "INSERT INTO item_components(item_id, component_id, qty) VALUES(?,?,?)",
+            [(item_id, comp_id, qty) for comp_id, qty in comps.items()],
+        )
+        audit.append(("stock_recipe", "item", item_id, {
+            "name": current[item_id]["name"],
+            "components": {current[k]["name"]: v for k, v in comps.items()},
+        }))
+    if updates:
+        update_stock_alerts(cur, cur.execute(
+            f"SELECT id, stock, low_stock FROM items WHERE id IN ({','.join('?' * len(updates))})",
+            [_id for _id, _ in updates],
+        ).fetchall())
+    log_actions(cur, audit, user=user)
+    c.commit(); c.close()
+    return jsonify(ok=True, changed=len(audit))
+
+
+@app.route("/api/admin/stock/events")
+def api_admin_stock_events():
+    """Server-Sent Events: offene Lagerwarnungen, gesendet sobald sie sich ändern"""
+    user = current_user()
+    if not user or not user.get("is_admin"):
+        return jsonify(ok=False, msg="Nicht berechtigt"), 403
+
+    def generate(interval=3, keepalive=30):
+        last, idle = None, 0
+        while True:
+            c = conn()
+            try:
+                alerts = load_stock_alerts(c)
+            finally:
+                c.close()
+            state = [(a["id"], a["stock"]) for a in alerts]
+            if state != last:
+                last, idle = state, 0
+                yield f"event: stock\ndata: {json.dumps(alerts, ensure_ascii=False)}\n\n"
+            elif idle >= keepalive:
+                idle = 0
+                yield ": keepalive\n\n"
+            time.sleep(interval); idle += interval
+
+    return event_stream(generate())
+
+
+# ---------- Schichten ----------
+
+def shift_report(c, shift_id):
+    """Schichtabrechnung aus den inkrementellen Summen (keine Scans über Verkäufe)"""
+    sh = c.execute(
+        "SELECT s.id, s.user_id, u.username AS user, s.opened_at, s.closed_at, s.opening_cash_cents, "
+        "s.counted_cash_cents, s.note "
+        "FROM shifts s LEFT JOIN users u ON u.id=s.user_id WHERE s.id=?", (shift_id,)
+    ).fetchone()
+    if not sh:
+        return None
+    per_payment = [dict(r) for r in c.execute(
+        "SELECT t.payment_method_id, p.name AS payment_method, p.protected, t.sales, t.revenue_cents "
+        "FROM shift_totals t LEFT JOIN payment_methods p ON p.id=t.payment_method_id "
+        "WHERE t.shift_id=? AND t.sales<>0 ORDER BY p.sort, t.payment_method_id", (shift_id,)
+    ).fetchall()]
+    # Rechnen in Rappen, Umrechnung erst für die Ausgabe
+    total = cash = 0
+    for r in per_payment:
+        r["protected"] = bool(r["protected"])
+        total += r["revenue_cents"]
+        if r["protected"]:  # geschützte Zahlart = Bar
+            cash += r["revenue_cents"]
+        r["revenue"] = from_cents(r.pop("revenue_cents"))
+    expected = sh["opening_cash_cents"] + cash
+    counted = sh["counted_cash_cents"]
+    return {
+        "id": sh["id"], "user_id": sh["user_id"], "user": sh["user"],
+        "opened_at": sh["opened_at"], "closed_at": sh["closed_at"], "note": sh["note"],
+        "per_payment": per_payment,
+        "sales": sum(r["sales"] for r in per_payment),
+        "total": from_cents(total),
+        "opening_cash": from_cents(sh["opening_cash_cents"]),
+        "expected_cash": from_cents(expected),
+        "counted_cash": from_cents(counted),
+        "cash_difference": from_cents(counted - expected) if counted is not None else None,
+    }
+
+
+@app.route("/api/shifts/current")
+def api_shift_current():
+    user = current_user()
+    if not user:
+        return jsonify(ok=False, msg="Nicht angemeldet"), 401
+    c = conn()
+    row = c.execute("SELECT id FROM shifts WHERE user_id=? AND closed_at IS NULL", (user["id"],)).fetchone()
+    report = shift_report(c, row[0]) if row else None
+    c.close()
+    return jsonify(ok=True, shift=report, currency=CURRENCY)
+
+
+@app.route("/api/shifts/open", methods=["POST"])
+def api_shift_open():
+    user = current_user()
+    if not user:
+        return jsonify(ok=False, msg="Nicht angemeldet"), 401
+    data = request.get_json(silent=True) or {}
+    try:
+        opening_cash_cents = to_cents(data.get("opening_cash"))
+    except ValueError:
+        return jsonify(ok=False, msg="Ungültiger Anfangsbestand"), 400
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    c = conn(); cur = c.cursor()
+    if cur.execute("SELECT 1 FROM shifts WHERE user_id=? AND closed_at IS NULL", (user["id"],)).fetchone():
+        c.close()
+        return jsonify(ok=False, msg="Schicht bereits offen"), 409
+    shift_id = open_shift_id(cur, user["id"], now, opening_cash_cents)
+    log_action(cur, "shift_open", entity_type="shift", entity_id=shift_id,
+               details={"opening_cash": from_cents(opening_cash_cents)}, user=user)
+    c.commit(); c.close()
+    return jsonify(ok=True, shift_id=shift_id)
+
+
+@app.route("/api/shifts/close", methods=["POST"])
+def api_shift_close():
+    """Schliesst die eigene offene Schicht (Admins: beliebige per shift_id) mit gezähltem Bargeld."""
+    user = current_user()
+    if not user:
+        return jsonify(ok=False, msg="Nicht angemeldet"), 401
+    data = request.get_json(silent=True) or {}
+    try:
+        counted = data.get("counted_cash")
+        counted = to_cents(counted) if counted not in (None, "") else None
+        shift_id = int(data["shift_id"]) if data.get("shift_id") else None
+    except (TypeError, ValueError):
+        return jsonify(ok=False, msg="Ungültige Eingabe"), 400
+    c = conn(); cur = c.cursor()
+    if shift_id and user.get("is_admin"):
+        row = cur.execute("SELECT id FROM shifts WHERE id=? AND closed_at IS NULL", (shift_id,)).fetchone()
+    else:
+        row = cur.execute("SELECT id FROM shifts WHERE user_id=? AND closed_at IS NULL", (user["id"],)).fetchone()
+    if not row:
+        c.close()
+        return jsonify(ok=False, msg="Keine offene Schicht"), 404
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    cur.execute(
+        "UPDATE shifts SET closed_at=?, counted_cash_cents=?, note=? WHERE id=?",
+        (now, counted, (data.get("note") or "").strip() or None, row[0]),
+    )
+    report = shift_report(c, row[0])
+    log_action(cur, "shift_close", entity_type="shift", entity_id=row[0],
+               details={"total": report["total"], "expected_cash": report["expected_cash"],
+                        "counted_cash": report["counted_cash"], "cash_difference": report["cash_difference"]}, user=user)
+    c.commit(); c.close()
+    return jsonify(ok=True, shift=report, currency=CURRENCY)
+
+
+@app.route("/api/admin/shifts")
+def api_admin_shifts():
+    """Schichten eines Tages (?date=YYYY-MM-DD, Default heute) bzw. alle offenen, inkl. Abrechnung"""
+    user = current_user()
+    if not user or not user.get("is_admin"):
+        return jsonify(ok=False, msg="Nicht berechtigt"), 403
+    day = request.args.get("date") or datetime.now().date().isoformat()
+    c = conn()
+    ids = [r[0] for r in c.execute(
+        "SELECT id FROM shifts WHERE closed_at IS NULL OR (opened_at < date(?, '+1 day') AND closed_at >= ?) "
+        "ORDER BY id DESC", (day, day)
+    ).fetchall()]
+    shifts = [shift_report(c, i) for i in ids]
+    c.close()
+    return jsonify(ok=True, date=day, shifts=shifts, currency=CURRENCY)
+
+
+@app.route("/export_shift/<int:shift_id>.csv")
+def export_shift_csv(shift_id):
+    """Schichtabrechnung als CSV"""
+    user = current_user()
+    if not user:
+        return redirect(url_for("login_page"))
+    c = conn()
+    report = shift_report(c, shift_id)
+    c.close()
+    if not report or (report["user_id"] != user["id"] and not user.get("is_admin")):
+        return jsonify(ok=False, msg="Schicht nicht gefunden"), 404
+    buf = io.StringIO(); w = csv.writer(buf, delimiter=';')
+    w.writerow([f"Schichtabrechnung #{shift_id}", report["user"]])
+    w.writerow(["Von", report["opened_at"], "Bis", report["closed_at"] or "offen"])
+    w.writerow([])
+    w.writerow(["Zahlart", "Transaktionen", "Gesamt"])
+    for r in report["per_payment"]:
+        w.writerow([r["payment_method"] or "Unbekannt", r["sales"], f"{r['revenue']:.2f}"])
+    w.writerow([])
+    w.writerow(["TOTAL", report["sales"], f"{report['total']:.2f} {CURRENCY}"])
+    w.writerow(["Anfangsbestand Bar", "", f"{report['opening_cash']:.2f}"])
+    w.writerow(["Soll Bar", "", f"{report['expected_cash']:.2f}"])
+    if report["counted_cash"] is not None:
+        w.writerow(["Gezählt Bar", "", f"{report['counted_cash']:.2f}"])
+        w.writerow(["Differenz", "", f"{report['cash_difference']:.2f}"])
+    mem = io.BytesIO(buf.getvalue().encode("utf-8")); mem.seek(0)
+    return send_file(mem, mimetype="text/csv", as_attachment=True, download_name=f"schicht_{shift_id}.csv")
+
+
 # ---------- Timer APIs ----------
+TIMER_SOUNDS = ("beep", "jingle_bells", "christmas_bells", "ho_ho_ho", "sleigh_ride")
 
 @app.route("/api/timers")
 def api_timers_list():
@@ -902,13 +2279,8 @@ def api_timers_list():
     if not user:
         return jsonify(ok=False, msg="Nicht angemeldet"), 401
     c = conn()
-    timers = [dict(r) for r in c.execute(
-        "SELECT id, label, duration_seconds, type, sound_enabled, sound_type FROM user_timers WHERE user_id=? ORDER BY id",
-        (user["id"],)
-    ).fetchall()]
+    timers = load_timers(c, user["id"])
     c.close()
-    for t in timers:
-        t["sound_enabled"] = bool(t["sound_enabled"])
     return jsonify(ok=True, timers=timers)
 
 
@@ -928,7 +2300,7 @@ def api_timer_create():
         timer_type = "timer"
     sound_enabled = 1 if data.get("sound_enabled", True) else 0
     sound_type = data.get("sound_type", "beep")
-    if sound_type not in ("beep", "jingle_bells", "christmas_bells", "ho_ho_ho", "sleigh_ride"):
+    if sound_type not in TIMER_SOUNDS:
         sound_type = "beep"
 
     c = conn(); cur = c.cursor()
@@ -965,7 +2337,7 @@ def api_timer_update(timer_id):
         timer_type = "timer"
     sound_enabled = 1 if data.get("sound_enabled", True) else 0
     sound_type = data.get("sound_type", "beep")
-    if sound_type not in ("beep", "jingle_bells", "christmas_bells", "ho_ho_ho", "sleigh_ride"):
+    if sound_type not in TIMER_SOUNDS:
         sound_type = "beep"
 
     cur.execute(
@@ -997,34 +2369,801 @@ def api_timer_delete(timer_id):
     return jsonify(ok=True)
 
 
+# ---------- Timer-Board (laufende Timer, für alle Kassen geteilt) ----------
+# Kompakter Zustand: pro Timer nur Startzeitpunkt (run_since) und bereits gelaufene Sekunden
+# (elapsed); die Anzeige rechnen die Clients selbst hoch. Gespeichert wird nur bei Zustands-
+# wechseln (Start/Pause/Reset/Entfernen) als eine Zeile in der eigenen Timer-DB (TIMER_DB_PATH).
+# Solange in einem Prozess ein Stream offen ist, übernimmt ein Watcher-Thread Änderungen anderer
+# Worker (PRAGMA data_version, ohne das Board zu lesen) und weckt die Streams; ohne Stream ruht er.
+_timer_board = {"version": 0, "seq": 0, "timers": []}
+_timer_cond = threading.Condition()
+_timer_watch_pid = None  # Prozess, in dem der Watcher gerade läuft
+_timer_streams = 0       # offene Streams in diesem Prozess
+
+
+def load_timer_board(c):
+    row = c.execute("SELECT value FROM board WHERE id=1").fetchone()
+    return json.loads(row["value"]) if row else {"version": 0, "seq": 0, "timers": []}
+
+
+def publish_timer_board(board):
+    global _timer_board
+    with _timer_cond:
+        if board["version"] != _timer_board["version"]:
+            _timer_board = board
+            _timer_cond.notify_all()
+
+
+def _watch_timer_board(interval=1):
+    global _timer_watch_pid
+    c, seen = None, None
+    try:
+        while True:
+            with _timer_cond:
+                if not _timer_streams:
+                    _timer_watch_pid = None  # letzter Stream zu -> Watcher endet
+                    return
+            try:
+                c = c or timer_conn()
+                version = c.execute("PRAGMA data_version").fetchone()[0]
+                if version != seen:
+                    seen = version
+                    publish_timer_board(load_timer_board(c))
+            except sqlite3.Error:
+                pass  # DB kurz gesperrt -> nächster Durchlauf
+            time.sleep(interval)
+    finally:
+        if c:
+            c.close()
+
+
+def timer_stream_opened():
+    """Ein Stream mehr in diesem Prozess; startet den Watcher bei Bedarf (auch nach einem Fork)."""
+    global _timer_streams, _timer_watch_pid
+    with _timer_cond:
+        _timer_streams += 1
+        if _timer_watch_pid == os.getpid():
+            return
+        _timer_watch_pid = os.getpid()
+    threading.Thread(target=_watch_timer_board, daemon=True, name="timer-watch").start()
+
+
+def timer_stream_closed():
+    global _timer_streams
+    with _timer_cond:
+        _timer_streams = max(0, _timer_streams - 1)
+
+
+def timer_elapsed(t, now):
+    return t["elapsed"] + (now - t["run_since"] if t["run_since"] else 0)
+
+
+def change_timer_board(fn):
+    """Wendet fn(board, now) unter Schreibsperre der Timer-DB auf das Board an und verteilt es."""
+    c = timer_conn()
+    try:
+        c.execute("BEGIN IMMEDIATE")
+        board = load_timer_board(c)
+        now = time.time()
+        result = fn(board, now)
+        if result is not None:
+            board["version"] += 1
+            c.execute("INSERT OR REPLACE INTO board(id, value) VALUES(1, ?)", (json.dumps(board),))
+        c.commit()
+    finally:
+        c.close()
+    publish_timer_board(board)
+    return result
+
+
+def timer_board_doc(board):
+    return {"version": board["version"], "now": time.time(), "timers": board["timers"]}
+
+
+@app.route("/api/timers/active")
+def api_timer_board():
+    if not current_user():
+        return jsonify(ok=False, msg="Nicht angemeldet"), 401
+    c = timer_conn()  # Polling-Kassen lesen direkt (kleine DB, kein Watcher nötig)
+    board = load_timer_board(c)
+    c.close()
+    return jsonify(ok=True, **timer_board_doc(board))
+
+
+@app.route("/api/timers/active", methods=["POST"])
+def api_timer_board_start():
+    """Startet einen neuen, für alle Kassen sichtbaren Timer"""
+    user = current_user()
+    if not user:
+        return jsonify(ok=False, msg="Nicht angemeldet"), 401
+    data = request.get_json(silent=True) or {}
+    label = (data.get("label") or "").strip()
+    if not label:
+        return jsonify(ok=False, msg="Label erforderlich"), 400
+    timer_type = data.get("type", "timer")
+    if timer_type not in ("timer", "stopwatch"):
+        timer_type = "timer"
+    duration = 0 if timer_type == "stopwatch" else int(data.get("duration_seconds") or 300)
+    sound_type = data.get("sound_type", "beep")
+    if sound_type not in TIMER_SOUNDS:
+        sound_type = "beep"
+
+    def start(board, now):
+        board["seq"] += 1
+        board["timers"].append({
+            "id": board["seq"], "label": label, "type": timer_type, "duration": duration,
+            "sound": sound_type if data.get("sound_enabled", True) else None,
+            "run_since": now, "elapsed": 0, "by": user["username"],
+        })
+        return board["seq"]
+
+    return jsonify(ok=True, id=change_timer_board(start))
+
+
+@app.route("/api/timers/active/<int:timer_id>/<action>", methods=["POST"])
+def api_timer_board_action(timer_id, action):
+    """toggle = Pause/Weiter (abgelaufene Timer starten neu), reset = zurück auf Anfang"""
+    if not current_user():
+        return jsonify(ok=False, msg="Nicht angemeldet"), 401
+    if action not in ("toggle", "reset"):
+        return jsonify(ok=False, msg="Unbekannte Aktion"), 400
+
+    def apply(board, now):
+        t = next((x for x in board["timers"] if x["id"] == timer_id), None)
+        if not t:
+            return None
+        if action == "reset":
+            t["elapsed"], t["run_since"] = 0, None
+        elif t["run_since"]:
+            if t["type"] == "timer" and timer_elapsed(t, now) >= t["duration"]:
+                t["elapsed"], t["run_since"] = 0, now  # abgelaufen -> neu starten
+            else:
+                t["elapsed"], t["run_since"] = timer_elapsed(t, now), None
+        else:
+            if t["type"] == "timer" and t["elapsed"] >= t["duration"]:
+                t["elapsed"] = 0
+            t["run_since"] = now
+        return t
+
+    t = change_timer_board(apply)
+    if not t:
+        return jsonify(ok=False, msg="Timer nicht gefunden"), 404
+    return jsonify(ok=True)
+
+
+@app.route("/api/timers/active/<int:timer_id>", methods=["DELETE"])
+def api_timer_board_remove(timer_id):
+    if not current_user():
+        return jsonify(ok=False, msg="Nicht angemeldet"), 401
+
+    def remove(board, now):
+        before = len(board["timers"])
+        board["timers"] = [t for t in board["timers"] if t["id"] != timer_id]
+        return True if len(board["timers"]) < before else None
+
+    if not change_timer_board(remove):
+        return jsonify(ok=False, msg="Timer nicht gefunden"), 404
+    return jsonify(ok=True)
+
+
+@app.route("/api/timers/events")
+def api_timer_board_events():
+    """Server-Sent Events: komplettes Board bei jeder Änderung (Clients zählen lokal weiter)"""
+    if not current_user():
+        return jsonify(ok=False, msg="Nicht angemeldet"), 401
+    c = timer_conn()
+    publish_timer_board(load_timer_board(c))  # aktueller Stand, auch wenn der Watcher gerade ruhte
+    c.close()
+
+    def generate(keepalive=25, max_age=600):
+        # Nach max_age beenden; EventSource verbindet automatisch neu (räumt tote Verbindungen ab)
+        version, started = None, time.time()
+        timer_stream_opened()
+        try:
+            yield "retry: 2000\n\n"
+            while time.time() - started < max_age:
+                with _timer_cond:
+                    if _timer_board["version"] == version:
+                        _timer_cond.wait(timeout=keepalive)
+                    board = _timer_board
+                if board["version"] != version:
+                    version = board["version"]
+                    yield f"event: timers\ndata: {json.dumps(timer_board_doc(board), ensure_ascii=False)}\n\n"
+                else:
+                    yield ": keepalive\n\n"
+        finally:
+            timer_stream_closed()
+
+    return event_stream(generate())
+
+
+AUDIT_CATEGORIES = ("login", "sale", "item", "stock", "user", "payment")
+AUDIT_COLUMNS = "a.id, a.ts, a.user_id, a.username, a.action, a.entity_type, a.entity_id, a.details, a.ip_address"
+
+
+def audit_filters(args, fts=True):
+    """
+    Baut WHERE-Klausel + Parameter für Audit-Log-Abfragen aus den Query-Parametern.
+    Alle Filter laufen über Indizes bzw. den FTS5-Index (audit_fts).
+    """
+    where, params = [], []
+    user_id = args.get("user_id")
+    if user_id:
+        where.append("a.user_id = ?"); params.append(int(user_id))
+    action = args.get("action")
+    category = args.get("category")
+    if action:
+        where.append("a.action = ?"); params.append(action)
+    elif category in AUDIT_CATEGORIES:
+        # Präfix-Bereich statt LIKE, damit idx_audit_action_ts greift ('`' folgt auf '_')
+        where.append("a.action >= ? AND a.action < ?"); params += [category + "_", category + "`"]
+    entity_type = args.get("entity_type")
+    if entity_type:
+        where.append("a.entity_type = ?"); params.append(entity_type)
+        entity_id = args.get("entity_id")
+        if entity_id:
+            where.append("a.entity_id = ?"); params.append(int(entity_id))
+    start = args.get("start")   # YYYY-MM-DD oder YYYY-MM-DD HH:MM:SS
+    if start:
+        where.append("a.ts >= ?"); params.append(start)
+    end = args.get("end")
+    if end:
+        if len(end) == 10:  # ganzer Tag inklusive
+            where.append("a.ts < date(?, '+1 day')")
+        else:
+            where.append("a.ts <= ?")
+        params.append(end)
+    q = (args.get("q") or "").strip()
+    if q:
+        if fts and AUDIT_FTS:
+            # Jedes Wort als Phrase quoten -> keine FTS-Syntaxfehler durch Benutzereingaben
+            match = " ".join('"' + t.replace('"', '""') + '"' for t in q.split())
+            where.append("a.id IN (SELECT rowid FROM audit_fts WHERE audit_fts MATCH ?)")
+            params.append(match)
+        else:
+            where.append("(a.details LIKE ? OR a.username LIKE ? OR a.action LIKE ?)")
+            params += [f"%{q}%"] * 3
+    return where, params
+
+
 @app.route("/api/admin/audit_log")
 def api_admin_audit_log():
+    """
+    Audit-Log mit Filtern (user_id, action, category, entity_type/entity_id,
+    start/end, q = Volltext) und Keyset-Pagination: ?before=<id> liefert die
+    Einträge älter als <id>, next_cursor ist der Wert für die nächste Seite.
+    """
     user = current_user()
     if not user or not user.get("is_admin"):
         return jsonify(ok=False, msg="Nicht berechtigt"), 403
 
-    c = conn()
     limit = request.args.get('limit', '20')
-    user_id = request.args.get('user_id')
+    before = request.args.get('before')
+    try:
+        where, params = audit_filters(request.args, fts=not request.args.get('archive'))
+        limit = int(limit) if limit else 0
+        if before:
+            where.append("a.id < ?"); params.append(int(before))
+    except ValueError:
+        return jsonify(ok=False, msg="Ungültige Filter"), 400
+
+    query = f"SELECT {AUDIT_COLUMNS} FROM audit_log a"
+    if where:
+        query += " WHERE " + " AND ".join(where)
+    query += " ORDER BY a.id DESC"
+    if limit > 0:
+        query += " LIMIT ?"
+        params.append(limit)
 
-    query = "SELECT id, ts, user_id, username, action, entity_type, entity_id, details, ip_address FROM audit_log"
-    params = []
+    archive = request.args.get('archive')  # YYYY-MM -> archivierten Monat abfragen
+    if archive:
+        c = load_audit_archive(archive)
+        if c is None:
+            return jsonify(ok=False, msg="Archiv nicht gefunden"), 404
+    else:
+        c = conn()
+    entries = [dict(r) for r in c.execute(query, params).fetchall()]
+    c.close()
 
-    if user_id:
-        query += " WHERE user_id = ?"
-        params.append(user_id)
+    next_cursor = entries[-1]["id"] if limit > 0 and len(entries) == limit else None
+    return jsonify(ok=True, entries=entries, next_cursor=next_cursor)
 
-    query += " ORDER BY id DESC"
 
-    if limit and limit != '0':
-        query += " LIMIT ?"
-        params.append(int(limit))
+@app.route("/api/admin/audit_log.ndjson")
+def api_admin_audit_log_export():
+    """Streaming-Export des (gefilterten) Audit-Logs als NDJSON, seitenweise per Keyset; ?archive=YYYY-MM wie oben"""
+    user = current_user()
+    if not user or not user.get("is_admin"):
+        return jsonify(ok=False, msg="Nicht berechtigt"), 403
+    archive = request.args.get('archive')
+    try:
+        where, params = audit_filters(request.args, fts=not archive)
+    except ValueError:
+        return jsonify(ok=False, msg="Ungültige Filter"), 400
+    if archive and (not re.fullmatch(r"\d{4}-\d{2}", archive) or not os.path.exists(audit_archive_path(archive))):
+        return jsonify(ok=False, msg="Archiv nicht gefunden"), 404
+
+    def generate(batch=1000):
+        c = load_audit_archive(archive) if archive else conn()
+        try:
+            last_id = None
+            while True:
+                w, p = list(where), list(params)
+                if last_id is not None:
+                    w.append("a.id < ?"); p.append(last_id)
+                query = f"SELECT {AUDIT_COLUMNS} FROM audit_log a"
+                if w:
+                    query += " WHERE " + " AND ".join(w)
+                rows = c.execute(query + " ORDER BY a.id DESC LIMIT ?", p + [batch]).fetchall()
+                if not rows:
+                    break
+                yield "".join(json.dumps(dict(r), ensure_ascii=False) + "\n" for r in rows)
+                last_id = rows[-1]["id"]
+        finally:
+            c.close()
 
-    entries = [dict(r) for r in c.execute(query, params).fetchall()]
+    today = datetime.now().strftime("%Y-%m-%d")
+    return Response(
+        stream_with_context(generate()),
+        mimetype="application/x-ndjson",
+        headers={"Content-Disposition": f"attachment; filename=audit_log_{archive or today}.ndjson"},
+    )
+
+
+# ---------- Audit-Archiv ----------
+
+def audit_archive_path(month):
+    return os.path.join(ARCHIVE_DIR, f"audit_{month}.ndjson.gz")
+
+
+def vacuum_db(c, pages=256, check=None):
+    """
+    Gibt freie Seiten in Schritten von `pages` an das Dateisystem zurück (nur im incremental
+    auto_vacuum-Modus, sonst 0). check() läuft vor jedem Schritt und darf abbrechen.
+    Liefert die Anzahl freigegebener Seiten.
+    """
+    if c.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        return 0
+    start = free = c.execute("PRAGMA freelist_count").fetchone()[0]
+    while free:
+        if check:
+            check()
+        c.execute(f"PRAGMA incremental_vacuum({int(pages)})").fetchall()  # jede Ergebniszeile = ein Schritt
+        free = c.execute("PRAGMA freelist_count").fetchone()[0]
+    return start
+
+
+def archive_audit_log(days=None, batch=5000, check=None):
+    """
+    Verschiebt Audit-Einträge älter als `days` Tage in monatliche, gzip-komprimierte
+    NDJSON-Dateien (ARCHIVE_DIR/audit_YYYY-MM.ndjson.gz) und löscht sie aus audit_log.
+    Gelöscht wird erst, nachdem der Batch geschrieben ist. `check` wird vor jedem Batch
+    aufgerufen und darf abbrechen; fertige Batches bleiben archiviert.
+    """
+    days = AUDIT_RETENTION_DAYS if days is None else days
+    if days <= 0:
+        return {"archived": 0, "months": []}
+    cutoff = (datetime.now() - timedelta(days=days)).strftime("%Y-%m-%d 00:00:00")
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    archived, months = 0, set()
+    c = conn()
+    try:
+        while True:
+            if check:
+                check()
+            rows = c.execute(
+                f"SELECT {AUDIT_COLUMNS} FROM audit_log a WHERE a.ts < ? ORDER BY a.id LIMIT ?",
+                (cutoff, batch),
+            ).fetchall()
+            if not rows:
+                break
+            by_month = {}
+            for r in rows:
+                by_month.setdefault(r["ts"][:7], []).append(dict(r))
+            # gzip-Member werden angehängt; gzip.open liest mehrere Member am Stück
+            for month, entries in by_month.items():
+                with gzip.open(audit_archive_path(month), "at", encoding="utf-8") as f:
+                    f.writelines(json.dumps(e, ensure_ascii=False) + "\n" for e in entries)
+            c.executemany("DELETE FROM audit_log WHERE id=?", [(r["id"],) for r in rows])
+            c.commit()
+            archived += len(rows)
+            months.update(by_month)
+        if archived:
+            vacuum_db(c, check=check)
+    finally:
+        c.close()
+    return {"archived": archived, "months": sorted(months)}
+
+
+def load_audit_archive(month):
+    """Lädt ein Monatsarchiv in eine In-Memory-DB, damit dieselben Audit-Filter greifen."""
+    if not re.fullmatch(r"\d{4}-\d{2}", month or "") or not os.path.exists(audit_archive_path(month)):
+        return None
+    m = sqlite3.connect(":memory:")
+    m.row_factory = sqlite3.Row
+    m.execute(
+        "CREATE TABLE audit_log(id INTEGER PRIMARY KEY, ts TEXT, user_id INTEGER, username TEXT, "
+        "action TEXT, entity_type TEXT, entity_id INTEGER, details TEXT, ip_address TEXT)"
+    )
+    cols = ("id", "ts", "user_id", "username", "action", "entity_type", "entity_id", "details", "ip_address")
+    with gzip.open(audit_archive_path(month), "rt", encoding="utf-8") as f:
+        m.executemany(
+            "INSERT OR REPLACE INTO audit_log VALUES(?,?,?,?,?,?,?,?,?)",
+            (tuple(e.get(k) for k in cols) for e in map(json.loads, f) if e),
+        )
+    return m
+
+
+@app.route("/api/admin/audit_archives")
+def api_admin_audit_archives():
+    user = current_user()
+    if not user or not user.get("is_admin"):
+        return jsonify(ok=False, msg="Nicht berechtigt"), 403
+    archives = []
+    if os.path.isdir(ARCHIVE_DIR):
+        for fn in sorted(os.listdir(ARCHIVE_DIR), reverse=True):
+            m = re.fullmatch(r"audit_(\d{4}-\d{2})\.ndjson\.gz", fn)
+            if m:
+                archives.append({"month": m.group(1), "size": os.path.getsize(os.path.join(ARCHIVE_DIR, fn))})
+    return jsonify(ok=True, archives=archives, retention_days=AUDIT_RETENTION_DAYS)
+
+
+@app.route("/api/admin/audit_archives", methods=["POST"])
+def api_admin_audit_archive_run():
+    """Archivierung sofort ausführen (optional mit abweichender Aufbewahrung in Tagen)"""
+    user = current_user()
+    if not user or not user.get("is_admin"):
+        return jsonify(ok=False, msg="Nicht berechtigt"), 403
+    data = request.get_json(silent=True) or {}
+    try:
+        days = int(data["days"]) if data.get("days") is not None else None
+    except (TypeError, ValueError):
+        return jsonify(ok=False, msg="Ungültige Anzahl Tage"), 400
+    result = archive_audit_log(days)
+    c = conn(); cur = c.cursor()
+    log_action(cur, "audit_archive", details=result, user=user)
+    c.commit(); c.close()
+    return jsonify(ok=True, **result)
+
+
+@app.route("/api/admin/vacuum", methods=["POST"])
+def api_admin_vacuum():
+    """
+    Bestehende DB einmalig auf incremental auto_vacuum umstellen (volles VACUUM – sperrt die DB
+    für die Dauer, daher nur als bewusste Admin-Aktion außerhalb des Kassenbetriebs).
+    Danach wird nur noch schrittweise freigegeben.
+    """
+    user = current_user()
+    if not user or not user.get("is_admin"):
+        return jsonify(ok=False, msg="Nicht berechtigt"), 403
+    c = conn()
+    try:
+        before = c.execute("PRAGMA page_count").fetchone()[0]
+        if c.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            c.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            c.execute("VACUUM")  # nötig, damit die Umstellung greift
+        else:
+            vacuum_db(c)
+        result = {"pages_before": before, "pages_after": c.execute("PRAGMA page_count").fetchone()[0]}
+    except sqlite3.OperationalError as e:
+        c.close()
+        return jsonify(ok=False, msg=f"VACUUM nicht möglich: {e}"), 409
+    cur = c.cursor()
+    log_action(cur, "db_vacuum", details=result, user=user)
+    c.commit(); c.close()
+    return jsonify(ok=True, **result)
+
+
+@app.route("/api/admin/audit_archives/<month>.ndjson.gz")
+def api_admin_audit_archive_download(month):
+    user = current_user()
+    if not user or not user.get("is_admin"):
+        return jsonify(ok=False, msg="Nicht berechtigt"), 403
+    if not re.fullmatch(r"\d{4}-\d{2}", month) or not os.path.exists(audit_archive_path(month)):
+        return jsonify(ok=False, msg="Archiv nicht gefunden"), 404
+    return send_file(audit_archive_path(month), mimetype="application/gzip", as_attachment=True,
+                     download_name=f"audit_{month}.ndjson.gz")
+
+
+# ---------- Leerlauf-Jobs ----------
+# Ein Worker (Lease-Zeile in leases) rechnet teure Dinge vor, sobald IDLE_SECONDS lang kein
+# /sale kam: Tagesauswertungen und PDFs (report_cache), Rollup-Prüfung, VACUUM, Backups.
+# Jeder Job prüft zwischen seinen Schritten check() und bricht ab, sobald wieder verkauft wird.
+
+SCHEDULER_LEASE = 120  # s; erneuert im Leerlauf-Takt und vor jedem Job
+_last_sale = 0.0      # letzter erfolgreicher /sale in diesem Prozess
+_last_activity = 0.0  # letzter neuer Verkaufskopf, den der Scheduler gesehen hat (alle Prozesse)
+_scheduler_lock = threading.Lock()
+_scheduler_pid = None
+
+
+class TillBusy(Exception):
+    """Kassenbetrieb läuft wieder – Leerlauf-Job abbrechen."""
+
+
+def sales_fingerprint(c, day=None):
+    """Billiger Stand der Verkäufe (gesamt oder eines Tages); ändert sich mit jedem Verkauf und Storno."""
+    if day is None:
+        row = c.execute("SELECT MAX(id), COUNT(*) FROM sale_headers").fetchone()
+    else:
+        row = c.execute(
+            "SELECT MAX(id), COUNT(*), TOTAL(total_cents) FROM sale_headers WHERE ts >= ? AND ts < date(?, '+1 day')",
+            (day, day),
+        ).fetchone()
+    return ":".join(str(v) for v in row)
+
+
+def cached_report(c, key, fingerprint):
+    row = c.execute("SELECT data FROM report_cache WHERE key=? AND fingerprint=?", (key, fingerprint)).fetchone()
+    return row["data"] if row else None
+
+
+def store_report(c, key, day, fingerprint, data):
+    c.execute(
+        "INSERT OR REPLACE INTO report_cache(key, day, fingerprint, data, created_at) VALUES(?,?,?,?,?)",
+        (key, day, fingerprint, data, datetime.now().strftime("%Y-%m-%d %H:%M:%S")),
+    )
+    c.commit()
+
+
+def report_days(c):
+    """Heute und gestern (Abschluss nach Mitternacht), sofern noch nicht abgeschlossen."""
+    days = [(datetime.now() - timedelta(days=n)).strftime("%Y-%m-%d") for n in (0, 1)]
+    closed = {r["day"] for r in c.execute("SELECT day FROM day_closes WHERE day IN (?, ?)", days)}
+    return [d for d in days if d not in closed]
+
+
+def job_summary(c, check):
+    today, fresh = datetime.now().strftime("%Y-%m-%d"), 0
+    for day in report_days(c):
+        check()
+        fingerprint = sales_fingerprint(c, day)
+        if cached_report(c, f"day:{day}", fingerprint) is None:
+            store_report(c, f"day:{day}", day, fingerprint, json.dumps(day_summary(c, day), ensure_ascii=False))
+            fresh += 1
+        if day == today and cached_report(c, f"summary:{day}", fingerprint) is None:
+            store_report(c, f"summary:{day}", day, fingerprint, json.dumps(admin_summary(c, day), ensure_ascii=False))
+            fresh += 1
+    # Vorberechnungen älterer Tage werden nicht mehr abgefragt (abgeschlossene Tage haben Snapshots)
+    c.execute("DELETE FROM report_cache WHERE day < ?", ((datetime.now() - timedelta(days=1)).strftime("%Y-%m-%d"),))
+    c.commit()
+    return f"{fresh} neu berechnet"
+
+
+def job_pdf(c, check):
+    fresh = 0
+    for day in report_days(c):
+        check()
+        fingerprint = sales_fingerprint(c, day)
+        if cached_report(c, f"pdf:{day}", fingerprint) is not None:
+            continue
+        cached = cached_report(c, f"day:{day}", fingerprint)
+        pdf = render_summary_pdf(json.loads(cached) if cached else day_summary(c, day))
+        if pdf is None:
+            return "reportlab nicht installiert"
+        store_report(c, f"pdf:{day}", day, fingerprint, pdf)
+        fresh += 1
+    return f"{fresh} neu gerendert"
+
+
+def job_available_days(c, check):
+    fingerprint = sales_fingerprint(c)
+    if cached_report(c, "available_days", fingerprint) is not None:
+        return "aktuell"
+    store_report(c, "available_days", None, fingerprint, json.dumps(available_days(c)))
+    return "neu berechnet"
+
+
+def job_rollup_check(c, check):
+    """Vergleicht die Rollups der letzten zwei Tage mit den Verkäufen; baut sie bei Abweichung neu auf."""
+    since = (datetime.now() - timedelta(days=1)).strftime("%Y-%m-%d")
+    hourly = (
+        "SELECT hour, payment_method_id, sales, revenue_cents FROM rollup_hourly "
+        "WHERE hour >= ?1 AND (sales != 0 OR revenue_cents != 0)",
+        "SELECT substr(ts,1,13), payment_method_id, COUNT(*), SUM(total_cents) FROM sale_headers "
+        "WHERE ts >= ?1 GROUP BY 1, 2",
+    )
+    items = (
+        "SELECT hour, item_id, qty, revenue_cents FROM rollup_hourly_items "
+        "WHERE hour >= ?1 AND (qty != 0 OR revenue_cents != 0)",
+        "SELECT substr(h.ts,1,13), l.item_id, SUM(l.qty), SUM(l.total_cents) "
+        "FROM sale_lines l JOIN sale_headers h ON h.id=l.sale_id WHERE h.ts >= ?1 GROUP BY 1, 2",
+    )
+    diff = 0
+    for actual, expected in (hourly, items):
+        check()
+        diff += c.execute(
+            f"SELECT (SELECT COUNT(*) FROM ({actual} EXCEPT {expected})) + "
+            f"(SELECT COUNT(*) FROM ({expected} EXCEPT {actual}))", (since,)
+        ).fetchone()[0]
+    if not diff:
+        return "ok"
+    check()
+    c.execute("BEGIN IMMEDIATE")
+    rebuild_rollups(c)
+    log_action(c.cursor(), "rollup_repair", details={"since": since, "rows": diff})
+    c.commit()
+    return f"{diff} abweichende Zeilen, Rollups neu aufgebaut"
+
+
+def job_audit_archive(c, check):
+    """Audit-Einträge älter als POS_AUDIT_RETENTION_DAYS archivieren (eigene Verbindung, batchweise)."""
+    return f"{archive_audit_log(check=check)['archived']} Einträge archiviert"
+
+
+def job_vacuum(c, check):
+    freed = vacuum_db(c, check=check)  # nur schrittweise; volles VACUUM nie im Hintergrund
+    c.execute("PRAGMA optimize")
+    return f"{freed} Seiten freigegeben"
+
+
+def job_backup(c, check):
+    """Konsistente Kopie über die SQLite-Backup-API, in Schritten (abbrechbar); behält BACKUP_KEEP Dateien."""
+    os.makedirs(BACKUP_DIR, exist_ok=True)
+    base = os.path.splitext(os.path.basename(DB_PATH))[0]
+    path = os.path.join(BACKUP_DIR, f"{base}_{datetime.now().strftime('%Y-%m-%d_%H%M')}.db")
+    tmp = f"{path}.{os.getpid()}.tmp"
+    dst = sqlite3.connect(tmp)
+    try:
+        c.backup(dst, pages=256, progress=lambda status, remaining, total: check())
+    except BaseException:
+        dst.close()
+        os.remove(tmp)
+        raise
+    dst.close()
+    os.replace(tmp, path)
+    backups = sorted(f for f in os.listdir(BACKUP_DIR) if re.fullmatch(re.escape(base) + r"_[\d_-]+\.db", f))
+    for old in backups[:-BACKUP_KEEP] if BACKUP_KEEP > 0 else []:
+        os.remove(os.path.join(BACKUP_DIR, old))
+    return f"{os.path.basename(path)} ({os.path.getsize(path) / 1e6:.1f} MB)"
+
+
+# Name, Mindestabstand in s (0 = aus), Funktion – günstige Vorberechnungen zuerst
+IDLE_JOBS = [
+    ("summary", 30, job_summary),
+    ("available_days", 30, job_available_days),
+    ("pdf", 30, job_pdf),
+    ("rollup_check", 3600, job_rollup_check),
+    ("audit_archive", 86400 if AUDIT_RETENTION_DAYS > 0 else 0, job_audit_archive),
+    ("vacuum", 3600, job_vacuum),
+    ("backup", BACKUP_HOURS * 3600, job_backup),
+]
+
+
+def acquire_lease(c, name, owner, seconds):
+    """Übernimmt/verlängert eine Lease; True, wenn owner sie danach hält."""
+    now = time.time()
+    got = c.execute(
+        "INSERT INTO leases(name, owner, expires_at) VALUES(?1, ?2, ?3) "
+        "ON CONFLICT(name) DO UPDATE SET owner=excluded.owner, expires_at=excluded.expires_at "
+        "WHERE leases.owner=excluded.owner OR leases.expires_at < ?4",
+        (name, owner, now + seconds, now),
+    ).rowcount
+    c.commit()
+    return got == 1
+
+
+def latest_sale_id(c):
+    return c.execute("SELECT MAX(id) FROM sale_headers").fetchone()[0]
+
+
+def run_idle_jobs(c, owner, marker):
+    """Führt fällige Jobs nacheinander aus; Abbruch (TillBusy), sobald wieder verkauft wird."""
+    def check():
+        # Nur lesen: ein Schreibzugriff würde ein laufendes Backup neu starten
+        if time.time() - _last_sale < IDLE_SECONDS:
+            raise TillBusy()
+        probe = conn()
+        try:
+            if latest_sale_id(probe) != marker:
+                raise TillBusy()
+        finally:
+            probe.close()
+
+    runs = {r["name"]: r for r in c.execute("SELECT name, last_run, last_ok, status FROM job_runs")}
+    for name, every, fn in IDLE_JOBS:
+        r = runs.get(name)
+        # Abgebrochene Jobs beim nächsten Leerlauf sofort wieder, sonst erst nach `every`
+        since = r and (r["last_ok"] if r["status"] == "busy" else r["last_run"])
+        if not every or (since and time.time() - since < every):
+            continue
+        if not acquire_lease(c, "scheduler", owner, SCHEDULER_LEASE):
+            return
+        started, status, msg = time.time(), "ok", None
+        try:
+            check()
+            msg = fn(c, check)
+        except TillBusy:
+            status = "busy"
+        except Exception as e:
+            status, msg = "error", str(e)
+        c.rollback()
+        ended = time.time()
+        c.execute(
+            "INSERT INTO job_runs(name, last_run, last_ok, duration_ms, status, msg, runs, worker) "
+            "VALUES(?1, ?2, CASE WHEN ?4='ok' THEN ?2 END, ?3, ?4, ?5, 1, ?6) "
+            "ON CONFLICT(name) DO UPDATE SET last_run=?2, last_ok=CASE WHEN ?4='ok' THEN ?2 ELSE last_ok END, "
+            "duration_ms=?3, status=?4, msg=?5, runs=runs+1, worker=?6",
+            (name, ended, round((ended - started) * 1000), status, msg, owner),
+        )
+        c.commit()
+        if status == "error":
+            app.logger.warning("Leerlauf-Job %s fehlgeschlagen: %s", name, msg)
+        if status == "busy":
+            return
+
+
+def _run_scheduler(poll=2):
+    global _last_activity
+    owner = f"{os.uname().nodename if hasattr(os, 'uname') else ''}:{os.getpid()}"
+    marker, leader, renewed = object(), False, 0.0
+    while True:
+        time.sleep(poll)
+        try:
+            c = conn()
+            try:
+                latest = latest_sale_id(c)
+                if latest != marker:
+                    marker, _last_activity = latest, time.time()
+                if time.time() - renewed >= SCHEDULER_LEASE / 4:
+                    leader, renewed = acquire_lease(c, "scheduler", owner, SCHEDULER_LEASE), time.time()
+                if leader and time.time() - max(_last_sale, _last_activity) >= IDLE_SECONDS:
+                    run_idle_jobs(c, owner, marker)
+            finally:
+                c.close()
+        except sqlite3.Error:
+            pass  # DB kurz gesperrt -> nächster Durchlauf
+
+
+def ensure_scheduler():
+    """Startet den Scheduler-Thread einmal pro Prozess (nach einem Fork neu); arbeiten darf nur der Lease-Inhaber."""
+    global _scheduler_pid
+    if not SCHEDULER or _scheduler_pid == os.getpid():
+        return
+    with _scheduler_lock:
+        if _scheduler_pid == os.getpid():
+            return
+        _scheduler_pid = os.getpid()
+    threading.Thread(target=_run_scheduler, daemon=True, name="idle-jobs").start()
+
+
+@app.route("/api/admin/jobs")
+def api_admin_jobs():
+    """Leerlauf-Jobs: letzte Ausführung, Dauer, Status und welcher Worker die Lease hält"""
+    user = current_user()
+    if not user or not user.get("is_admin"):
+        return jsonify(ok=False, msg="Nicht berechtigt"), 403
+    c = conn()
+    lease = c.execute("SELECT owner, expires_at FROM leases WHERE name='scheduler'").fetchone()
+    runs = {r["name"]: dict(r) for r in c.execute(
+        "SELECT name, last_run, last_ok, duration_ms, status, msg, runs, worker FROM job_runs"
+    ).fetchall()}
     c.close()
 
-    return jsonify(ok=True, entries=entries)
+    def fmt(ts):
+        return datetime.fromtimestamp(ts).strftime("%Y-%m-%d %H:%M:%S") if ts else None
+
+    jobs = []
+    for name, every, _ in IDLE_JOBS:
+        r = runs.get(name, {"runs": 0})
+        jobs.append({
+            "name": name, "every": every, "last_run": fmt(r.get("last_run")), "last_ok": fmt(r.get("last_ok")),
+            "duration_ms": r.get("duration_ms"), "status": r.get("status"), "msg": r.get("msg"),
+            "runs": r["runs"], "worker": r.get("worker"),
+        })
+    return jsonify(ok=True, enabled=SCHEDULER, idle_seconds=IDLE_SECONDS,
+                   leader=lease["owner"] if lease and lease["expires_at"] > time.time() else None, jobs=jobs)
 
 
 if __name__ == "__main__":
+    # Produktionsserver mit gunicorn.conf.py; Flask-Dev-Server mit POS_DEV=1 oder ohne gunicorn (Windows)
+    here = os.path.dirname(os.path.abspath(__file__))
+    from importlib.util import find_spec
+    use_gunicorn = os.name == "posix" and not os.environ.get("POS_DEV") and find_spec("gunicorn") is not None
+    if use_gunicorn:
+        os.execv(sys.executable, [sys.executable, "-m", "gunicorn", "-c", os.path.join(here, "gunicorn.conf.py"),
+                                  "--chdir", here])
+    # Der Dev-Server startet pro Verbindung einen Thread – Streams nehmen /sale nichts weg
+    if "POS_STREAM_SLOTS" not in os.environ:
+        _stream_slots = threading.Semaphore(64)
     app.run(host="0.0.0.0", port=8000, debug=False)
\ No newline at end of file
@@ -0,0 +1,195 @@
+"""
+Optionaler ASGI-Modus für Hot-Dog POS.
+
+    pip install a2wsgi uvicorn
+    uvicorn asgi:app --host 0.0.0.0 --port 8000
+    POS_ASGI=1 gunicorn -c gunicorn.conf.py           (uvicorn-Worker, sonst wie gewohnt)
+
+Alle Routen aus POS.py laufen unverändert über einen WSGI-Adapter in einem begrenzten
+Thread-Pool (POS_ASGI_THREADS) – dort passiert auch jeder SQLite-Zugriff, /sale verhält sich
+also exakt wie unter gunicorn/gthread. Nur die langlebigen Streams sind hier asynchron
+umgesetzt: pro Prozess gibt es einen Erzeuger je Stream, die Clients warten als Koroutinen
+auf dessen Änderungen (wenige KB statt eines Threads pro offenem Bildschirm).
+"""
+import asyncio, json, os, threading, time
+from http.cookies import SimpleCookie
+
+try:
+    from a2wsgi import WSGIMiddleware
+except ImportError as e:  # optionale Abhängigkeit
+    raise ImportError("ASGI-Modus benötigt a2wsgi (pip install a2wsgi uvicorn)") from e
+
+import POS
+
+THREADS = int(os.environ.get("POS_ASGI_THREADS", "16"))
+wsgi = WSGIMiddleware(POS.app, workers=THREADS)
+
+
+async def run_db(fn, *args):
+    """SQLite-Zugriff im begrenzten Pool des WSGI-Adapters (nie im Event-Loop)."""
+    return await asyncio.get_running_loop().run_in_executor(wsgi.executor, fn, *args)
+
+
+def session_user_id(scope):
+    """user_id aus dem signierten Flask-Session-Cookie."""
+    raw = dict(scope["headers"]).get(b"cookie")
+    if not raw:
+        return None
+    morsel = SimpleCookie(raw.decode("latin-1")).get(POS.app.config["SESSION_COOKIE_NAME"])
+    serializer = POS.app.session_interface.get_signing_serializer(POS.app)
+    if not morsel or serializer is None:
+        return None
+    try:
+        data = serializer.loads(morsel.value, max_age=int(POS.app.permanent_session_lifetime.total_seconds()))
+    except Exception:
+        return None
+    return data.get("user_id")
+
+
+def load_user(uid):
+    c = POS.conn()
+    u = c.execute("SELECT id, username, is_admin FROM users WHERE id=? AND active=1", (uid,)).fetchone()
+    c.close()
+    return dict(u) if u else None
+
+
+class Hub:
+    """Letzter Stand eines Streams + Benachrichtigung aller wartenden Clients."""
+
+    def __init__(self, event, start, opened=None, closed=None):
+        self.event, self.start = event, start
+        self.opened, self.closed = opened, closed  # optional: Client-Zählung beim Erzeuger
+        self.version, self.data = None, None
+        self.cond = None
+        self.started = False
+
+    def publish(self, version, data):
+        if version == self.version:
+            return
+        self.version, self.data = version, data
+        asyncio.ensure_future(self._notify())
+
+    async def _notify(self):
+        async with self.cond:
+            self.cond.notify_all()
+
+    def ensure_started(self):
+        if not self.started:
+            self.started = True
+            self.cond = asyncio.Condition()
+            self.start(self, asyncio.get_running_loop())
+
+    async def stream(self, send, keepalive=25, max_age=600):
+        self.ensure_started()
+        if self.opened:
+            self.opened()
+        try:
+            seen, started = None, time.time()
+            await send_chunk(send, "retry: 2000\n\n")
+            while time.time() - started < max_age:
+                async with self.cond:
+                    if self.version == seen:
+                        try:
+                            await asyncio.wait_for(self.cond.wait_for(lambda: self.version != seen), keepalive)
+                        except asyncio.TimeoutError:
+                            pass
+                if self.version != seen and self.data is not None:
+                    seen = self.version
+                    await send_chunk(send, f"event: {self.event}\ndata: {json.dumps(self.data, ensure_ascii=False)}\n\n")
+                else:
+                    await send_chunk(send, ": keepalive\n\n")
+        finally:
+            if self.closed:
+                self.closed()
+
+
+def start_timer_producer(hub, loop):
+    """
+    Ein Thread pro Prozess wartet auf Board-Änderungen (POS._timer_cond) und reicht sie weiter;
+    den DB-Watcher dahinter halten die offenen Clients am Laufen (timer_stream_opened/closed).
+    """
+    def run():
+        version = None
+        while True:
+            with POS._timer_cond:
+                if POS._timer_board["version"] == version:
+                    POS._timer_cond.wait(timeout=30)
+                board = POS._timer_board
+            if board["version"] != version:
+                version = board["version"]
+                loop.call_soon_threadsafe(hub.publish, version, POS.timer_board_doc(board))
+
+    threading.Thread(target=run, daemon=True, name="timer-hub").start()
+
+
+def start_stock_producer(hub, loop, interval=3):
+    """Eine Abfrage alle interval Sekunden pro Prozess – unabhängig von der Anzahl Clients."""
+    def load():
+        c = POS.conn()
+        try:
+            return POS.load_stock_alerts(c)
+        finally:
+            c.close()
+
+    async def run():
+        while True:
+            try:
+                alerts = await run_db(load)
+                hub.publish(json.dumps([(a["id"], a["stock"]) for a in alerts]), alerts)
+            except Exception:
+                pass  # DB kurz gesperrt -> nächster Durchlauf
+            await asyncio.sleep(interval)
+
+    loop.create_task(run())
+
+
+STREAMS = {
+    "/api/timers/events": (Hub("timers", start_timer_producer, POS.timer_stream_opened, POS.timer_stream_closed), False),
+    "/api/admin/stock/events": (Hub("stock", start_stock_producer), True),
+}
+
+
+async def send_chunk(send, text):
+    await send({"type": "http.response.body", "body": text.encode(), "more_body": True})
+
+
+async def send_json(send, status, doc):
+    body = json.dumps(doc).encode()
+    await send({"type": "http.response.start", "status": status,
+                "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]})
+    await send({"type": "http.response.body", "body": body})
+
+
+async def serve_stream(scope, receive, send, hub, admin_only):
+    uid = session_user_id(scope)
+    user = await run_db(load_user, uid) if uid else None
+    if not user:
+        return await send_json(send, 401, {"ok": False, "msg": "Nicht angemeldet"})
+    if admin_only and not user["is_admin"]:
+        return await send_json(send, 403, {"ok": False, "msg": "Nicht berechtigt"})
+    await send({"type": "http.response.start", "status": 200, "headers": [
+        (b"content-type", b"text/event-stream; charset=utf-8"),
+        (b"cache-control", b"no-store"),
+        (b"x-accel-buffering", b"no"),
+    ]})
+
+    async def disconnected():
+        while (await receive())["type"] != "http.disconnect":
+            pass
+
+    streaming = asyncio.ensure_future(hub.stream(send))
+    watcher = asyncio.ensure_future(disconnected())
+    await asyncio.wait({streaming, watcher}, return_when=asyncio.FIRST_COMPLETED)
+    for task in (streaming, watcher):
+        task.cancel()
+    try:
+        await send({"type": "http.response.body", "body": b""})
+    except Exception:
+        pass  # Client schon weg
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "http" and scope["method"] == "GET" and scope["path"] in STREAMS:
+        hub, admin_only = STREAMS[scope["path"]]
+        return await serve_stream(scope, receive, send, hub, admin_only)
+    return await wsgi(scope, receive, send)
@@ -0,0 +1,139 @@
+"""
+gunicorn-Konfiguration für Hot-Dog POS.
+
+    gunicorn -c gunicorn.conf.py              (oder einfach: python POS.py)
+
+- preload_app: POS wird einmal im Master importiert (init_db, Katalog-Cache); die Worker
+  teilen diesen Zustand per Copy-on-Write und öffnen in post_fork eigene Verbindungen.
+- Worker/Threads aus CPU-Anzahl (inkl. Container-Limit) und Lastprofil POS_PROFILE.
+- Katalogänderungen holen sich die Worker selbst (Versionsprüfung pro Anfrage); POS_RELOAD_ON_CATALOG=1
+  ersetzt sie zusätzlich per SIGHUP – kappt dabei aber alle offenen Streams und laufenden Anfragen.
+- Kaltstart-Zeit und Speicher (RSS/PSS/privat) von Master und Workern landen im Log.
+- POS_ASGI=1: uvicorn-Worker mit asgi:app (Streams ohne Thread pro Client, siehe asgi.py).
+
+Umgebungsvariablen: POS_PROFILE (stand|event|backoffice), POS_WORKERS, POS_THREADS, POS_STREAM_SLOTS,
+POS_BIND (Default 0.0.0.0:8000), POS_RELOAD_ON_CATALOG (1/0).
+"""
+import math, os, signal, threading, time
+
+_started = time.time()
+
+# Lastprofile: Worker pro CPU, max. Worker, Threads pro Worker.
+# SQLite hat genau einen Schreiber – mehr Prozesse bringen für Verkäufe nichts, Threads
+# werden aber von den SSE-Streams (Timer, Lagerwarnungen) dauerhaft belegt: ein Thread pro Bildschirm.
+PROFILES = {
+    "stand": (1, 2, 16),       # ein Stand, wenige Kassen
+    "event": (1, 4, 32),       # viele Kassen und Küchenbildschirme
+    "backoffice": (2, 8, 4),   # Auswertungen/PDF, CPU-gebunden
+}
+
+
+def _cpu_count():
+    """CPUs, die dieser Prozess wirklich nutzen darf (Affinität und cgroup-Quota im Container)."""
+    try:
+        n = len(os.sched_getaffinity(0))
+    except AttributeError:
+        n = os.cpu_count() or 1
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            n = min(n, max(1, math.ceil(int(quota) / int(period))))
+    except (OSError, ValueError):
+        pass
+    return n
+
+
+def _memory(pid="self"):
+    """Speicher in MB aus /proc (Linux): rss, pss (anteilig geteilt), private (nur dieser Prozess)."""
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            kb = {line.split(":")[0]: int(line.split()[1]) for line in f if line.split()[-1] == "kB"}
+        private = kb.get("Private_Clean", 0) + kb.get("Private_Dirty", 0)
+        return "rss=%.1f MB pss=%.1f MB private=%.1f MB" % (kb["Rss"] / 1024, kb["Pss"] / 1024, private / 1024)
+    except (OSError, KeyError, ValueError):
+        import resource
+        return "maxrss=%.1f MB" % (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024)
+
+
+_profile = os.environ.get("POS_PROFILE", "stand")
+_per_cpu, _max_workers, _threads = PROFILES.get(_profile, PROFILES["stand"])
+
+bind = os.environ.get("POS_BIND", "0.0.0.0:8000")
+workers = int(os.environ.get("POS_WORKERS") or min(_max_workers, max(1, _cpu_count() * _per_cpu)))
+threads = int(os.environ.get("POS_THREADS") or _threads)
+# Höchstens die Hälfte der Threads für SSE-Streams; der Rest bleibt für /sale & Co. (POS liest das beim Import)
+os.environ.setdefault("POS_STREAM_SLOTS", str(threads // 2))
+if os.environ.get("POS_ASGI") == "1":
+    # Threads bilden hier den Pool für WSGI-Routen/SQLite; Streams kosten keinen Thread
+    worker_class = "uvicorn.workers.UvicornWorker"
+    wsgi_app = "asgi:app"
+    os.environ.setdefault("POS_ASGI_THREADS", str(threads))
+else:
+    worker_class = "gthread"
+    wsgi_app = "POS:app"
+preload_app = True
+timeout = 60
+graceful_timeout = 10  # offene SSE-Streams nicht abwarten, Browser verbinden neu
+keepalive = 5
+
+# Opt-in: Kassen und Worker sehen Katalogänderungen ohnehin über catalog_version
+_reload_on_catalog = os.environ.get("POS_RELOAD_ON_CATALOG", "0") == "1"
+
+
+def _watch_catalog(server, interval=5, settle=10):
+    """Master-Thread: bei neuer Katalog-Version (und danach settle s Ruhe) Cache neu laden + SIGHUP."""
+    import POS
+
+    def current_version():
+        with POS.fork_lock:  # nie während eines Forks in SQLite stecken
+            c = POS.conn()
+            try:
+                return POS.catalog_version(c)
+            finally:
+                c.close()
+
+    known = current_version()
+    seen, changed_at = known, None
+    while True:
+        time.sleep(interval)
+        try:
+            version = current_version()
+        except Exception as e:
+            server.log.warning("Katalog-Prüfung fehlgeschlagen: %s", e)
+            continue
+        if version != seen:
+            seen, changed_at = version, time.time()  # weitere Änderungen abwarten (Bulk-Speichern)
+        if seen != known and changed_at and time.time() - changed_at >= settle:
+            with POS.fork_lock:
+                POS.warm_caches()
+            known = seen
+            server.log.info("Katalog-Version %s: Worker werden sanft ersetzt", known)
+            os.kill(os.getpid(), signal.SIGHUP)
+
+
+def when_ready(server):
+    import POS
+    POS.warm_caches()
+    server.log.info(
+        "Profil %s: %d Worker x %d Threads (%d CPU) – Kaltstart %.0f ms, Master %s",
+        _profile, server.cfg.workers, server.cfg.threads, _cpu_count(),
+        (time.time() - _started) * 1000, _memory(),
+    )
+    if _reload_on_catalog:
+        threading.Thread(target=_watch_catalog, args=(server,), daemon=True, name="catalog-watch").start()
+
+
+def post_fork(server, worker):
+    import POS
+    worker._pos_forked = time.time()
+    POS.after_fork()
+
+
+def post_worker_init(worker):
+    worker.log.info("Worker %s bereit nach %.0f ms: %s",
+                    worker.pid, (time.time() - worker._pos_forked) * 1000, _memory())
+
+
+def worker_exit(server, worker):
+    server.log.info("Worker %s beendet: %s", worker.pid, _memory())
@@ -0,0 +1,313 @@
+"""
+Last- und Konsistenztest für Verkauf/Storno (/sale, /undo, /api/admin/delete_sale).
+
+Mehrere Prozesse mit je mehreren Threads feuern gemischte Anfragen gegen die Flask-App
+(in-process über den Test-Client oder per HTTP gegen einen laufenden Server) und prüfen
+danach die Invarianten der Datenbank:
+
+  - Header-Total = Summe der Positionen, keine verwaisten Positionen / leeren Verkäufe
+  - jede Position verweist auf eine Artikelversion
+  - rollup_hourly, rollup_hourly_items und shift_totals stimmen mit den Verkäufen überein
+  - Lager: Anfangsbestand = Endbestand + netto verkaufte Mengen (über die Rezepte aufgelöst);
+    eine neue temporäre DB bekommt dafür geführte Bestände und ein Rezept
+
+Ausgabe: Durchsatz, Latenzen, Statuscodes und Anteil "database is locked".
+
+    python stress.py                                   # temporäre DB, 4 Prozesse x 8 Threads, 10 s
+    python stress.py -p 2 -t 16 -d 30 --db /tmp/x.db
+    python stress.py --url http://localhost:8000 --db sales.db   # laufender Server (gunicorn)
+
+Nie gegen die Produktions-DB laufen lassen: es werden echte Verkäufe angelegt und storniert.
+"""
+import argparse, json, multiprocessing, os, random, sqlite3, sys, tempfile, threading, time
+import http.cookiejar, urllib.error, urllib.request
+
+MIX = (("sale", 0.7), ("undo", 0.15), ("delete", 0.15))
+
+
+class HttpClient:
+    """Minimaler Client mit Session-Cookie für einen laufenden Server."""
+
+    def __init__(self, base):
+        self.base = base.rstrip("/")
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+
+    def request(self, method, path, payload=None):
+        data = json.dumps(payload).encode() if payload is not None else None
+        req = urllib.request.Request(self.base + path, data=data, method=method,
+                                     headers={"Content-Type": "application/json"} if data else {})
+        try:
+            with self.opener.open(req, timeout=30) as resp:
+                return resp.status, json.loads(resp.read() or b"null")
+        except urllib.error.HTTPError as e:
+            body = e.read()
+            try:
+                return e.code, json.loads(body)
+            except ValueError:
+                return e.code, None
+
+
+class AppClient:
+    """Flask-Test-Client (eigene Session pro Thread)."""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, payload=None):
+        resp = self.client.open(path, method=method, json=payload)
+        return resp.status_code, resp.get_json(silent=True)
+
+
+def worker(args, client, stats, lock_errors, ready, start, deadline, seed):
+    rnd = random.Random(seed)
+    status, body = client.request("POST", "/api/login", {"username": args.user, "pin": args.pin})
+    if status != 200 or not body.get("ok"):
+        raise SystemExit(f"Login fehlgeschlagen: {status} {body}")
+    _, boot = client.request("GET", "/api/pos/bootstrap")
+    items = [i["id"] for i in boot["items"]]  # Kassenkatalog enthält nur aktive Einträge
+    methods = [m["id"] for m in boot["payment_methods"]]
+    mine = []  # eigene Verkäufe (Kandidaten für delete_sale)
+    actions, weights = zip(*MIX)
+    # Messung beginnt erst, wenn alle Prozesse/Threads gestartet und angemeldet sind
+    ready.wait()
+    start.wait()
+    while time.time() < deadline.value:
+        action = rnd.choices(actions, weights)[0]
+        t0 = time.perf_counter()
+        if action == "sale":
+            lines = [{"item_id": rnd.choice(items), "qty": rnd.randint(1, 3)} for _ in range(rnd.randint(1, 4))]
+            status, body = client.request("POST", "/sale", {"lines": lines, "payment_method_id": rnd.choice(methods)})
+            if status == 200 and body.get("ok"):
+                mine.append(body["sale_id"])
+        elif action == "undo":
+            status, body = client.request("POST", "/undo")
+        else:
+            sale_id = mine.pop(rnd.randrange(len(mine))) if mine else 1
+            status, body = client.request("DELETE", f"/api/admin/delete_sale/{sale_id}")
+        dt = time.perf_counter() - t0
+        ok = status < 500
+        s = stats.setdefault(action, {"n": 0, "ok": 0, "err": 0, "lat": []})
+        s["n"] += 1; s["ok" if ok else "err"] += 1; s["lat"].append(dt)
+        s.setdefault("status", {}).setdefault(str(status), 0)
+        s["status"][str(status)] += 1
+    stats["_lock_errors"] = stats.get("_lock_errors", 0) + lock_errors.pop(threading.get_ident(), 0)
+
+
+def run_process(args, seed, queue, start, deadline):
+    """Ein Prozess: startet args.threads Worker-Threads und liefert deren Statistik."""
+    lock_errors = {}
+    if args.url:
+        make_client = lambda: HttpClient(args.url)
+    else:
+        os.environ["POS_DB"] = args.db
+        import POS
+        from flask import got_request_exception
+
+        def on_error(sender, exception, **extra):
+            if isinstance(exception, sqlite3.OperationalError) and "locked" in str(exception):
+                tid = threading.get_ident()
+                lock_errors[tid] = lock_errors.get(tid, 0) + 1
+
+        got_request_exception.connect(on_error, POS.app, weak=False)
+        POS.app.logger.disabled = True  # 500er werden gezählt, nicht geloggt
+        make_client = lambda: AppClient(POS.app)
+
+    results = [dict() for _ in range(args.threads)]
+    ready = threading.Barrier(args.threads + 1)
+    threads = [
+        threading.Thread(target=worker, args=(args, make_client(), results[i], lock_errors, ready, start, deadline,
+                                              seed * 1000 + i))
+        for i in range(args.threads)
+    ]
+    for t in threads:
+        t.start()
+    ready.wait()
+    queue.put("ready")
+    for t in threads:
+        t.join()
+    queue.put(results)
+
+
+def merge(all_stats):
+    total = {"_lock_errors": 0}
+    for st in all_stats:
+        total["_lock_errors"] += st.pop("_lock_errors", 0)
+        for action, s in st.items():
+            m = total.setdefault(action, {"n": 0, "ok": 0, "err": 0, "lat": [], "status": {}})
+            m["n"] += s["n"]; m["ok"] += s["ok"]; m["err"] += s["err"]; m["lat"] += s["lat"]
+            for code, n in s["status"].items():
+                m["status"][code] = m["status"].get(code, 0) + n
+    return total
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else 0
+
+
+# Verbrauch aller vorhandenen Verkaufspositionen je Lagerartikel, wie STOCK_UPDATE_SQL in POS.py
+CONSUMED_SQL = """
+    SELECT COALESCE(r.component_id, l.item_id), SUM(l.qty * COALESCE(r.qty, 1))
+    FROM sale_lines l LEFT JOIN item_components r ON r.item_id = l.item_id
+    GROUP BY 1
+"""
+
+
+def setup_stock(POS):
+    """Neue Test-DB: alle Artikel mit Bestand führen, Hot Dogs verbrauchen zusätzlich Brot (Rezept)."""
+    c = POS.conn()
+    c.execute("UPDATE items SET stock = 1000000, low_stock = 10")
+    c.execute("INSERT INTO items(name, price_cents, active, sort, stock, low_stock) VALUES('Brot', 0, 0, 99, 1000000, 10)")
+    bread = c.execute("SELECT id FROM items WHERE name = 'Brot'").fetchone()[0]
+    c.executemany(
+        "INSERT INTO item_components(item_id, component_id, qty) SELECT id, ?, ? FROM items WHERE name = ?",
+        [(bread, 1, "Hot Dog"), (bread, 1, "Veggie Dog")],
+    )
+    POS.bump_catalog_version(c)
+    c.commit(); c.close()
+
+
+def stock_snapshot(db):
+    """(Bestand je geführtem Artikel, bisheriger Verbrauch je Artikel) – vor und nach dem Lauf vergleichen."""
+    c = sqlite3.connect(db)
+    stock = dict(c.execute("SELECT id, stock FROM items WHERE stock IS NOT NULL").fetchall())
+    consumed = dict(c.execute(CONSUMED_SQL).fetchall())
+    c.close()
+    return stock, consumed
+
+
+def check_invariants(db, before=None):
+    """Liefert eine Liste (Beschreibung, Anzahl Verstösse); before = stock_snapshot() vor dem Lauf."""
+    c = sqlite3.connect(db)
+    checks = {
+        "Header-Total != Summe Positionen": """
+            SELECT COUNT(*) FROM sale_headers h
+            WHERE h.total_cents != (SELECT COALESCE(SUM(total_cents), 0) FROM sale_lines WHERE sale_id = h.id)""",
+        "Verkäufe ohne Positionen": """
+            SELECT COUNT(*) FROM sale_headers h WHERE NOT EXISTS (SELECT 1 FROM sale_lines WHERE sale_id = h.id)""",
+        "verwaiste Positionen (sale_items)": """
+            SELECT COUNT(*) FROM sale_items si WHERE NOT EXISTS (SELECT 1 FROM sale_headers WHERE id = si.sale_id)""",
+        "Positionen ohne Artikelversion": """
+            SELECT COUNT(*) FROM sale_items si WHERE NOT EXISTS (SELECT 1 FROM item_versions WHERE id = si.version_id)""",
+    }
+    # Rollups: Nullzeilen (alles storniert) sind erlaubt
+    rollups = {
+        "rollup_hourly": (
+            "SELECT hour, payment_method_id, sales, revenue_cents FROM rollup_hourly WHERE sales != 0 OR revenue_cents != 0",
+            "SELECT substr(ts,1,13), payment_method_id, COUNT(*), SUM(total_cents) FROM sale_headers GROUP BY 1, 2",
+        ),
+        "rollup_hourly_items": (
+            "SELECT hour, item_id, qty, revenue_cents FROM rollup_hourly_items WHERE qty != 0 OR revenue_cents != 0",
+            "SELECT substr(h.ts,1,13), l.item_id, SUM(l.qty), SUM(l.total_cents) "
+            "FROM sale_lines l JOIN sale_headers h ON h.id = l.sale_id GROUP BY 1, 2",
+        ),
+        "shift_totals": (
+            "SELECT shift_id, payment_method_id, sales, revenue_cents FROM shift_totals WHERE sales != 0 OR revenue_cents != 0",
+            "SELECT shift_id, payment_method_id, COUNT(*), SUM(total_cents) FROM sale_headers "
+            "WHERE shift_id IS NOT NULL GROUP BY 1, 2",
+        ),
+    }
+    for name, (stored, expected) in rollups.items():
+        # symmetrische Differenz (Klammern nötig: EXCEPT/UNION werden links nach rechts ausgewertet)
+        checks[f"{name} stimmt nicht"] = (
+            f"SELECT (SELECT COUNT(*) FROM (SELECT * FROM ({stored}) EXCEPT SELECT * FROM ({expected})))"
+            f" + (SELECT COUNT(*) FROM (SELECT * FROM ({expected}) EXCEPT SELECT * FROM ({stored})))"
+        )
+    result = [(name, c.execute(sql).fetchone()[0]) for name, sql in checks.items()]
+    if before is not None:
+        (stock0, consumed0), (stock1, consumed1) = before, stock_snapshot(db)
+        result.append(("Lagerbestand stimmt nicht (Artikel)", sum(
+            1 for i in stock0
+            if stock0[i] - stock1.get(i, 0) != consumed1.get(i, 0) - consumed0.get(i, 0)
+        )))
+    result.append(("Verkäufe gesamt (Info)", c.execute("SELECT COUNT(*) FROM sale_headers").fetchone()[0]))
+    c.close()
+    return result
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    ap.add_argument("-p", "--processes", type=int, default=4)
+    ap.add_argument("-t", "--threads", type=int, default=8, help="Threads pro Prozess")
+    ap.add_argument("-d", "--duration", type=float, default=10, help="Sekunden")
+    ap.add_argument("--db", help="SQLite-Datei (Default: neue temporäre DB)")
+    ap.add_argument("--url", help="Basis-URL eines laufenden Servers statt Test-Client")
+    ap.add_argument("--user", default="Admin")
+    ap.add_argument("--pin", default="1234")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--json", action="store_true", help="Ergebnis als JSON ausgeben")
+    args = ap.parse_args()
+    if not args.db:
+        if args.url:
+            ap.error("--url benötigt --db (Datenbank des Servers) für die Invariantenprüfung")
+        args.db = os.path.join(tempfile.mkdtemp(prefix="pos-stress-"), "stress.db")
+    args.db = os.path.abspath(args.db)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+    fresh = not os.path.exists(args.db)
+    if not args.url:
+        # Schema + Seeds einmal vorab anlegen, damit die Prozesse nicht um init_db() konkurrieren
+        os.environ["POS_DB"] = args.db
+        import POS
+        if fresh:
+            setup_stock(POS)
+    before = stock_snapshot(args.db)
+
+    ctx = multiprocessing.get_context("spawn")
+    queue, start, deadline = ctx.Queue(), ctx.Event(), ctx.Value("d", 0.0)
+    procs = [ctx.Process(target=run_process, args=(args, args.seed + i, queue, start, deadline))
+             for i in range(args.processes)]
+    for p in procs:
+        p.start()
+    for _ in procs:
+        queue.get()  # "ready"
+    t0 = time.time()
+    deadline.value = t0 + args.duration
+    start.set()
+    all_stats = []
+    for _ in procs:
+        all_stats += queue.get()
+    for p in procs:
+        p.join()
+    elapsed = time.time() - t0
+
+    stats = merge(all_stats)
+    lock_errors = stats.pop("_lock_errors")
+    requests_total = sum(s["n"] for s in stats.values())
+    invariants = check_invariants(args.db, before)
+    violations = sum(n for name, n in invariants if "(Info)" not in name)
+    report = {
+        "db": args.db,
+        "processes": args.processes, "threads": args.threads, "seconds": round(elapsed, 2),
+        "requests": requests_total,
+        "throughput_rps": round(requests_total / elapsed, 1) if elapsed else 0,
+        "lock_errors": lock_errors,
+        "lock_error_rate": round(lock_errors / requests_total, 4) if requests_total else 0,
+        "actions": {
+            a: {"n": s["n"], "errors": s["err"], "status": s["status"],
+                "p50_ms": round(percentile(s["lat"], 0.5) * 1000, 1),
+                "p99_ms": round(percentile(s["lat"], 0.99) * 1000, 1)}
+            for a, s in stats.items()
+        },
+        "invariants": dict(invariants),
+        "ok": violations == 0,
+    }
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print(f"DB: {args.db}")
+        print(f"{args.processes} Prozesse x {args.threads} Threads, {elapsed:.1f} s: "
+              f"{requests_total} Anfragen, {report['throughput_rps']} req/s")
+        print(f"Lock-Fehler: {lock_errors} ({report['lock_error_rate']:.2%})"
+              + ("" if not args.url else " (nur im Test-Client-Modus messbar, siehe 5xx)"))
+        for a, s in report["actions"].items():
+            print(f"  {a:<7} n={s['n']:<6} 5xx={s['errors']:<4} p50={s['p50_ms']} ms  p99={s['p99_ms']} ms  {s['status']}")
+        print("Invarianten:")
+        for name, n in invariants:
+            mark = "  " if "(Info)" in name else ("OK" if n == 0 else "!!")
+            print(f"  [{mark}] {name}: {n}")
+    sys.exit(0 if report["ok"] else 1)
+
+
+if __name__ == "__main__":
+    main()